@@ -1,6 +1,6 @@
 #!/bin/bash
 #
-rm data/cache_data.ndjson
+rm -f data/cache.sqlite data/cache.sqlite-wal data/cache.sqlite-shm
 # setting up modelserver an zmq-model-broker
 ./zmqBroker.py --frontendsocket tcp://127.0.0.1:5559 --backendsocket tcp://127.0.0.1:5560 &
 ./modelServer.py --zmqsocket tcp://127.0.0.1:5560 --model models/ner-english-ontonotes-large.bin  &
@@ -4,10 +4,29 @@ import logging
 import argparse
 import uuid
 import json
+import os
+import sqlite3
+import time
+import threading
+import queue
+import signal
+import sys
+import zlib
+import glob
+import re
+from collections import defaultdict
 
 
 import zmq
 
+# optional - compact encoding of the cached values
+try:
+    import msgpack
+    import zstandard
+except ImportError:
+    msgpack = None
+    zstandard = None
+
 
 
 # configure logging and LOGGER
@@ -17,37 +36,504 @@ logging.basicConfig(format='%(asctime)s %(name)s' +
 LOGGER = logging.getLogger(__name__)
 
 
+# the frontend passes the requests on to the reader-threads via this socket
+READER_ENDPOINT = "inproc://readers"
+
+# requests without "ns" use the database given by '--cache'
+DEFAULT_NAMESPACE = "default"
+NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# '--durability' -> sqlite synchronous
+SYNCHRONOUS = { "none": "OFF", "periodic": "NORMAL", "batch": "FULL" }
+
 # argparse magic
 class RawTextDefaultsHelpFormatter(argparse.RawDescriptionHelpFormatter,
                                    argparse.ArgumentDefaultsHelpFormatter):
     pass
 
-def rereadcache(args):
+def cacheKey(key):
+    """the internal cachekey of a (sentence-)string"""
+    return str(uuid.uuid5(uuid.NAMESPACE_X500, key))
+
+# the first byte of a stored value tells how it is encoded. values stored as text are json
+CODEC_ZLIB = b"z" # zlib-compressed json
+CODEC_ZSTD = b"m" # zstd-compressed msgpack
+
+def defaultCodec():
+    return "zstd" if not isinstance(zstandard, type(None)) else "zlib"
+
+def encodeValue(value, codec):
+    if codec == "zstd":
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=3).compress(msgpack.packb(value, use_bin_type=True))
+    elif codec == "zlib":
+        return CODEC_ZLIB + zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+    return json.dumps(value)
+
+def decodeValue(data):
+    """the value of a stored entry in any encoding"""
+    if isinstance(data, str):
+        return json.loads(data)
+    if data[:1] == CODEC_ZSTD:
+        assert not isinstance(zstandard, type(None)), "msgpack and zstandard are needed to read this cache"
+        return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(data[1:]), raw=False)
+    elif data[:1] == CODEC_ZLIB:
+        return json.loads(zlib.decompress(data[1:]).decode('utf-8'))
+    raise ValueError("unknown encoding %s" % (str(data[:1])))
+
+# evict down to this part of '--maxentries'/'--maxbytes', so not every store evicts
+EVICTION_WATERMARK = 0.9
+# entries deleted per transaction while evicting - one chunk per store or maintenance
+EVICTION_CHUNK = 1000
+
+class SqliteStore(object):
     """
-    prefill the cache with local data
+    the cache on disc. sqlite reads the database via mmap, so opening it is instant
+    and lookups are served from the page-cache of the os. the values are encoded by codec.
+    if the cache grows beyond maxentries/maxbytes the least recently (lru) or the least
+    frequently (lfu) used entries are evicted
     """
-    result = {}
-    try:
-        with open(args.cache) as fp:
-            for line in fp.readlines():
-                tmp = json.loads(line)
-                cache_key = str(uuid.uuid5(uuid.NAMESPACE_X500,tmp['key']))
-                result[cache_key] = tmp['value']
-    except Exception as exep:
-        LOGGER.warning("Could not read cachefile at %s: %s",args.cache, str(exep))
 
-    return result
+    def __init__(self, path, mmapsize=0, maxentries=0, maxbytes=0, eviction="lru", touchbatch=1000, synchronous="NORMAL", codec=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.eviction = eviction
+        self.touchbatch = touchbatch
+        self.codec = codec if not isinstance(codec, type(None)) else defaultCodec()
+        assert self.codec != "zstd" or not isinstance(zstandard, type(None)), "the zstd-codec needs msgpack and zstandard"
+        # cache_key -> (atime, hits) of lookups that are not written yet
+        self.touched = {}
+        self.evicted = 0
+        self.evictionrunning = False
 
-def main(args):
-    cache=rereadcache(args)
+        # the store may be created by the main-thread and used by the writer-thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # only possible before the first table is created - old caches stay without it
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # OFF: leave it to the os, NORMAL: sync on checkpoints, FULL: sync every transaction
+        self.db.execute("PRAGMA synchronous=%s" % (synchronous))
+        self.db.execute("PRAGMA mmap_size=%d" % (mmapsize))
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                        " size INTEGER NOT NULL DEFAULT 0, atime REAL NOT NULL DEFAULT 0, hits INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(cache)")]
+        if 'size' not in columns:
+            LOGGER.warning("adding the columns for the eviction to %s", path)
+            self.db.execute("ALTER TABLE cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self.db.execute("ALTER TABLE cache ADD COLUMN atime REAL NOT NULL DEFAULT 0")
+            self.db.execute("ALTER TABLE cache ADD COLUMN hits INTEGER NOT NULL DEFAULT 0")
+            self.db.execute("UPDATE cache SET size = length(key) + length(value)")
+        if self.eviction == "lfu":
+            self.db.execute("CREATE INDEX IF NOT EXISTS cache_hits ON cache (hits, atime)")
+        else:
+            self.db.execute("CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)")
+        self.db.commit()
 
-    context = zmq.Context()
-    socket = context.socket(zmq.REP)
+        if self.db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            LOGGER.warning("%s does not free the space of evicted entries - VACUUM it once with the cacheServer stopped", path)
+        self.entries, self.bytes = self.db.execute("SELECT count(*), total(size) FROM cache").fetchone()
+        LOGGER.info("%d entries with %d bytes in %s - storing values as %s", self.entries, self.bytes, path, self.codec)
+
+    def __len__(self):
+        return self.entries
+
+    def get(self, cache_key):
+        """the value of the cache_key or None on a cachemiss"""
+        row = self.db.execute("SELECT value FROM cache WHERE key = ?", (cache_key,)).fetchone()
+        if isinstance(row, type(None)):
+            return None
+        atime, hits = self.touched.get(cache_key, (0, 0))
+        self.touched[cache_key] = (time.time(), hits + 1)
+        if len(self.touched) >= self.touchbatch:
+            self.flushTouched()
+        return decodeValue(row[0])
+
+    def put(self, cache_key, value):
+        self.putmany([(cache_key, value)])
+
+    def putmany(self, items):
+        """store (cache_key, value)-pairs in one transaction - later pairs win"""
+        now = time.time()
+        rows = {}
+        for cache_key, value in items:
+            data = encodeValue(value, self.codec)
+            rows[cache_key] = (cache_key, data, len(cache_key) + len(data), now)
+        keys = list(rows)
+        with self.db:
+            # replaced entries don't count twice
+            for offset in range(0, len(keys), 500):
+                chunk = keys[offset:offset + 500]
+                entries, size = self.db.execute("SELECT count(*), total(size) FROM cache WHERE key IN (%s)"
+                                                % (",".join("?" * len(chunk))), chunk).fetchone()
+                self.entries = self.entries - entries
+                self.bytes = self.bytes - size
+            # a stored key keeps its hits - otherwise lfu evicts the hot keys that are stored again
+            self.db.executemany("INSERT INTO cache (key, value, size, atime, hits) VALUES (?, ?, ?, ?, 0)"
+                                " ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, atime = excluded.atime",
+                                list(rows.values()))
+        self.entries = self.entries + len(rows)
+        self.bytes = self.bytes + sum([row[2] for row in rows.values()])
+        self.evict()
+
+    def touch(self, touched):
+        """add the lookups of a reader - (atime, hits) per cache_key"""
+        for cache_key, (atime, hits) in touched.items():
+            lastatime, lasthits = self.touched.get(cache_key, (0, 0))
+            self.touched[cache_key] = (max(atime, lastatime), hits + lasthits)
+        if len(self.touched) >= self.touchbatch:
+            self.flushTouched()
+
+    def flushTouched(self):
+        """write the access-times and hits of the lookups since the last flush"""
+        if len(self.touched) == 0:
+            return
+        with self.db:
+            self.db.executemany("UPDATE cache SET atime = ?, hits = hits + ? WHERE key = ?",
+                                [(atime, hits, cache_key) for cache_key, (atime, hits) in self.touched.items()])
+        self.touched = {}
+
+    def overBudget(self, watermark=1.0):
+        return ((self.maxentries > 0 and self.entries > self.maxentries * watermark)
+                or (self.maxbytes > 0 and self.bytes > self.maxbytes * watermark))
+
+    def evicting(self):
+        """True while the store is evicting down to the watermark"""
+        return self.overBudget(EVICTION_WATERMARK) and (self.evictionrunning or self.overBudget())
+
+    def evict(self):
+        """
+        evict one chunk of the least recently/frequently used entries. once over budget, every
+        store and maintenance evicts a chunk until the store is down to the watermark - so
+        neither waits for the whole eviction
+        """
+        self.evictionrunning = self.evicting()
+        if not self.evictionrunning:
+            return False
+        self.flushTouched()
+        order = "hits, atime" if self.eviction == "lfu" else "atime"
+        # the amount of entries to evict - by the average size for the bytes
+        needed = 1
+        if self.maxentries > 0:
+            needed = max(needed, self.entries - int(self.maxentries * EVICTION_WATERMARK))
+        if self.maxbytes > 0 and self.entries > 0:
+            needed = max(needed, int((self.bytes - self.maxbytes * EVICTION_WATERMARK) / (self.bytes / self.entries)) + 1)
+        rows = self.db.execute("SELECT key, size FROM cache ORDER BY %s LIMIT %d"
+                               % (order, min(needed, EVICTION_CHUNK))).fetchall()
+        with self.db:
+            self.db.executemany("DELETE FROM cache WHERE key = ?", [(cache_key,) for cache_key, size in rows])
+        self.entries = self.entries - len(rows)
+        self.bytes = self.bytes - sum([size for cache_key, size in rows])
+        self.evicted = self.evicted + len(rows)
+        self.evictionrunning = len(rows) > 0 and self.evicting()
+        LOGGER.info("evicted %d entries - %d entries with %d bytes left", len(rows), self.entries, self.bytes)
+        return self.evictionrunning
+
+    def maintain(self, vacuumpages=1000):
+        """
+        runs while the cacheServer is idle: write the lookups, evict a chunk, give up to
+        vacuumpages pages of evicted entries back to the filesystem and fold the
+        write-ahead-log into the database. True while the eviction is not done
+        """
+        self.flushTouched()
+        evicting = self.evict()
+        freepages = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        if freepages > 0:
+            # every step of the pragma frees one page - execute() steps it only once, the
+            # script is run to the end
+            self.db.executescript("PRAGMA incremental_vacuum(%d);" % (min(freepages, vacuumpages)))
+            LOGGER.info("gave %d pages back to the filesystem", freepages - self.db.execute("PRAGMA freelist_count").fetchone()[0])
+        self.db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return evicting
+
+    def sync(self):
+        """fold the write-ahead-log into the database - synced to disc"""
+        self.db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self.flushTouched()
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.close()
+
+def namespacePath(cache, namespace):
+    """the database of a namespace - next to the one of the default namespace"""
+    if namespace == DEFAULT_NAMESPACE:
+        return cache
+    base, ext = os.path.splitext(cache)
+    return "%s.%s%s" % (base, namespace, ext)
+
+def namespaces(cache):
+    """the namespaces that have a database on disc"""
+    base, ext = os.path.splitext(cache)
+    found = [DEFAULT_NAMESPACE] if os.path.exists(cache) else []
+    for path in glob.glob(glob.escape(base) + ".*" + glob.escape(ext)):
+        namespace = path[len(base) + 1:len(path) - len(ext)]
+        if NAMESPACE_PATTERN.match(namespace):
+            found.append(namespace)
+    return found
+
+class CacheWriter(object):
+    """
+    owns the SqliteStores - one per namespace - and writes to them from a thread of its
+    own, so a slow disc never blocks a lookup. stored values are kept in an overlay until
+    they are written, so the readers see them at once
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.queue = queue.Queue()
+        # (namespace, cache_key) -> (sequence, value) of the stores that are not written yet
+        self.overlay = {}
+        self.sequence = 0
+        # namespace -> increased on every drop, so the readers reopen the database
+        self.generations = defaultdict(int)
+        # namespace -> counters of the requests
+        self.stats = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+        self.stores = {}
+        for namespace in namespaces(args.cache):
+            self.store(namespace)
+
+    def store(self, namespace):
+        """the store of a namespace - created on the first use. only used by the writer-thread"""
+        if namespace not in self.stores:
+            maxentries, maxbytes = self.args.budgets.get(namespace, (self.args.maxentries, self.args.maxbytes))
+            self.stores[namespace] = SqliteStore(namespacePath(self.args.cache, namespace), self.args.mmapsize,
+                                                 maxentries, maxbytes, self.args.eviction,
+                                                 synchronous=SYNCHRONOUS[self.args.durability],
+                                                 codec=None if self.args.codec == "auto" else self.args.codec)
+            LOGGER.info("opened namespace %s", namespace)
+        return self.stores[namespace]
 
-    socket.bind(args.zmqsocket)
-    LOGGER.info("Starting mainloop")
+    def generation(self, namespace):
+        with self.lock:
+            return self.generations[namespace]
+
+    def count(self, namespace, **counters):
+        with self.lock:
+            for key, value in counters.items():
+                self.stats[namespace][key] = self.stats[namespace][key] + value
+
+    def namespaceStats(self):
+        """entries, bytes and counters per namespace"""
+        with self.lock:
+            result = dict([(namespace, dict(counters)) for namespace, counters in self.stats.items()])
+        for namespace, store in list(self.stores.items()):
+            result.setdefault(namespace, {})
+            result[namespace].update({ "entries": store.entries, "bytes": store.bytes, "evicted": store.evicted,
+                                       "maxentries": store.maxentries, "maxbytes": store.maxbytes })
+        return result
+
+    def lookup(self, namespace, cache_key):
+        """(True, value) if the cache_key is waiting to be written, (False, None) otherwise"""
+        with self.lock:
+            if (namespace, cache_key) in self.overlay:
+                return True, self.overlay[(namespace, cache_key)][1]
+        return False, None
+
+    def putmany(self, namespace, items):
+        items = list(items)
+        with self.lock:
+            self.sequence = self.sequence + 1
+            for cache_key, value in items:
+                self.overlay[(namespace, cache_key)] = (self.sequence, value)
+            self.queue.put(("put", self.sequence, (namespace, items)))
+
+    def touch(self, namespace, touched):
+        self.queue.put(("touch", None, (namespace, touched)))
+
+    def drop(self, namespace):
+        """forget a namespace. the stores that are queued before are dropped too"""
+        with self.lock:
+            for key in [key for key in self.overlay if key[0] == namespace]:
+                del self.overlay[key]
+            self.stats.pop(namespace, None)
+        self.queue.put(("drop", None, namespace))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """write everything that is queued and close the stores"""
+        self.queue.put(("stop", None, None))
+        self.thread.join()
+
+    def write(self, batch):
+        """write the (sequence, (namespace, items)) of several stores - one transaction per namespace"""
+        grouped = defaultdict(list)
+        for sequence, (namespace, items) in batch:
+            grouped[namespace].extend(items)
+        for namespace, items in grouped.items():
+            try:
+                self.store(namespace).putmany(items)
+            except Exception as excep:
+                LOGGER.warning("Could not store on disc: %s",str(excep))
+        with self.lock:
+            # a later store of the same key stays until it is written too
+            for sequence, (namespace, items) in batch:
+                for cache_key, value in items:
+                    if self.overlay.get((namespace, cache_key), (None, None))[0] == sequence:
+                        del self.overlay[(namespace, cache_key)]
+        LOGGER.debug("wrote %d stores", len(batch))
+
+    def dropStore(self, namespace):
+        """close the database of a namespace and remove its files"""
+        store = self.stores.pop(namespace, None)
+        if not isinstance(store, type(None)):
+            store.db.close()
+        path = namespacePath(self.args.cache, namespace)
+        for filename in [path, path + "-wal", path + "-shm"]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        with self.lock:
+            self.generations[namespace] = self.generations[namespace] + 1
+        LOGGER.warning("dropped namespace %s", namespace)
+
+    def run(self):
+        maintenance_at = time.time() + self.args.maintenanceinterval
+        sync_at = time.time() + self.args.fsyncinterval
+        running = True
+        evicting = False
+        while running:
+            try:
+                # while a store evicts, a chunk is evicted on every round
+                command, sequence, data = self.queue.get(timeout=0 if evicting else self.args.maintenanceinterval)
+            except queue.Empty:
+                command = None
+
+            # collect stores until the batch is full or the first one waited 'writedelay'
+            batch = []
+            entries = 0
+            deadline = time.time() + self.args.writedelay / 1000
+            while not isinstance(command, type(None)):
+                if command == "put":
+                    batch.append((sequence, data))
+                    entries = entries + len(data[1])
+                elif command == "touch":
+                    if data[0] in self.stores:
+                        self.stores[data[0]].touch(data[1])
+                elif command == "drop":
+                    # the stores queued before the drop are dropped with it
+                    self.write(batch)
+                    batch = []
+                    self.dropStore(data)
+                elif command == "stop":
+                    running = False
+                if entries >= self.args.writebatch:
+                    break
+                try:
+                    if running:
+                        command, sequence, data = self.queue.get(timeout=max(0, deadline - time.time()))
+                    else:
+                        # drain the queue before stopping
+                        command, sequence, data = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if len(batch) > 0:
+                self.write(batch)
+
+            if self.args.durability == "periodic" and time.time() > sync_at:
+                for store in self.stores.values():
+                    store.sync()
+                sync_at = time.time() + self.args.fsyncinterval
+
+            # the maintenance runs if nothing is to be written for a while - or is overdue
+            if running and (len(batch) == 0 or time.time() > maintenance_at):
+                evicting = any([store.maintain() for store in list(self.stores.values())])
+                maintenance_at = time.time() + (0 if evicting else self.args.maintenanceinterval)
+
+        for store in self.stores.values():
+            store.close()
+        LOGGER.info("writer stopped")
+
+class CacheReader(object):
+    """
+    the sqlite-connections of one reader-thread - one per namespace. stores are handed
+    to the writer, the lookups are handed to it in batches for the eviction
+    """
+
+    def __init__(self, writer, args):
+        self.writer = writer
+        self.args = args
+        self.touchbatch = 1000
+        # namespace -> {cache_key: (atime, hits)}
+        self.touched = defaultdict(dict)
+        # namespace -> (generation, connection)
+        self.connections = {}
+
+    def connection(self, namespace):
+        """the connection to the database of a namespace - None if it has none yet"""
+        generation = self.writer.generation(namespace)
+        current = self.connections.get(namespace, None)
+        if not isinstance(current, type(None)):
+            if current[0] == generation:
+                return current[1]
+            # the namespace was dropped meanwhile
+            current[1].close()
+            del self.connections[namespace]
+        path = namespacePath(self.args.cache, namespace)
+        if not os.path.exists(path):
+            return None
+        db = sqlite3.connect(path)
+        db.execute("PRAGMA mmap_size=%d" % (self.args.mmapsize))
+        db.execute("PRAGMA query_only=ON")
+        self.connections[namespace] = (generation, db)
+        return db
+
+    def get(self, namespace, cache_key):
+        """the value of the cache_key or None on a cachemiss"""
+        found, value = self.writer.lookup(namespace, cache_key)
+        if not found:
+            db = self.connection(namespace)
+            row = None
+            if not isinstance(db, type(None)):
+                try:
+                    row = db.execute("SELECT value FROM cache WHERE key = ?", (cache_key,)).fetchone()
+                except sqlite3.OperationalError as excep:
+                    # the writer did not create the table yet
+                    LOGGER.debug("could not read namespace %s: %s", namespace, str(excep))
+            if isinstance(row, type(None)):
+                self.writer.count(namespace, misses=1)
+                return None
+            value = decodeValue(row[0])
+        self.writer.count(namespace, hits=1)
+        atime, hits = self.touched[namespace].get(cache_key, (0, 0))
+        self.touched[namespace][cache_key] = (time.time(), hits + 1)
+        if len(self.touched[namespace]) >= self.touchbatch:
+            self.flushTouched()
+        return value
+
+    def put(self, namespace, cache_key, value):
+        self.putmany(namespace, [(cache_key, value)])
+
+    def putmany(self, namespace, items):
+        items = list(items)
+        self.writer.count(namespace, stores=len(items))
+        self.writer.putmany(namespace, items)
+
+    def flushTouched(self):
+        for namespace, touched in self.touched.items():
+            if len(touched) > 0:
+                self.writer.touch(namespace, touched)
+        self.touched = defaultdict(dict)
+
+def readerThread(context, writer, args):
+    """
+    answers the requests the frontend passes on. every reader has its own connection to
+    the database, so lookups run concurrently
+    """
+    cache = CacheReader(writer, args)
+    socket = context.socket(zmq.REP)
+    socket.connect(READER_ENDPOINT)
 
     while True:
+        # hand the lookups to the writer if no request came in for a while
+        if not socket.poll(args.maintenanceinterval * 1000):
+            cache.flushTouched()
+            continue
+
         message = socket.recv()
         LOGGER.debug(f"Received request: {message}")
         jmsg = None
@@ -58,12 +544,21 @@ def main(args):
             socket.send(json.dumps({"result": None, "error": str(excep)}).encode('utf-8'))
             continue
 
+        ns = jmsg.get('ns', DEFAULT_NAMESPACE) if isinstance(jmsg, dict) else None
+        if not isinstance(ns, str) or not NAMESPACE_PATTERN.match(ns):
+            LOGGER.warning("skipping - invalid namespace: %s", str(ns))
+            socket.send(json.dumps({
+                "result": None,
+                "error": "invalid namespace - use up to 64 of the characters A-Z a-z 0-9 _ -"
+            }).encode('utf-8'))
+            continue
+
         if 'cmd' in jmsg:
             if jmsg['cmd'] == 'store':
                 if 'key' in jmsg and 'value' in jmsg:
                     cache_key = None
                     try:
-                        cache_key = str(uuid.uuid5(uuid.NAMESPACE_X500,jmsg['key']))
+                        cache_key = cacheKey(jmsg['key'])
                     except Exception as excep:
                         LOGGER.warning("skipping - could not create cache_key: %s", str(excep))
                         socket.send(json.dumps({
@@ -72,13 +567,15 @@ def main(args):
                         }).encode('utf-8'))
                         continue
                     # all good store it
-                    cache[cache_key] = jmsg['value']
                     try:
-                        with open(args.cache,'a') as cache_file:
-                            cache_file.write(json.dumps({jmsg['key']: jmsg['value']}))
-                            cache_file.write("\n")
+                        cache.put(ns, cache_key, jmsg['value'])
                     except Exception as excep:
                         LOGGER.warning("Could not store on disc: %s",str(excep))
+                        socket.send(json.dumps({
+                            "result": None,
+                            "error": "could not store value"
+                        }).encode('utf-8'))
+                        continue
 
                     socket.send(json.dumps({ "result": "ACK", "error": None }).encode('utf-8'))
                 else:
@@ -93,7 +590,7 @@ def main(args):
                 if 'key' in jmsg :
                     cache_key = None
                     try:
-                        cache_key = str(uuid.uuid5(uuid.NAMESPACE_X500,jmsg['key']))
+                        cache_key = cacheKey(jmsg['key'])
                     except Exception as excep:
                         LOGGER.warning("skipping - could not create cache_key: %s", str(excep))
                         socket.send(json.dumps({
@@ -102,8 +599,8 @@ def main(args):
                         }).encode('utf-8'))
                         continue
                     # all good - pull it
-                    if cache_key in cache:
-                        data = cache[cache_key]
+                    data = cache.get(ns, cache_key)
+                    if not isinstance(data, type(None)):
                         LOGGER.debug("cachehit for: %s->%s",cache_key,jmsg['key'])
                         socket.send(json.dumps({ "result": data, "error": None }).encode('utf-8'))
                     else:
@@ -117,6 +614,77 @@ def main(args):
                         "error": "key missing in message"
                     }).encode('utf-8'))
                     continue
+            elif jmsg['cmd'] == 'mget':
+                if isinstance(jmsg.get('keys', None), list):
+                    try:
+                        cache_keys = [cacheKey(key) for key in jmsg['keys']]
+                    except Exception as excep:
+                        LOGGER.warning("skipping - could not create cache_key: %s", str(excep))
+                        socket.send(json.dumps({
+                            "result": None,
+                            "error": "could not create (internal) cache_key"
+                        }).encode('utf-8'))
+                        continue
+                    data = [cache.get(ns, cache_key) for cache_key in cache_keys]
+                    LOGGER.debug("%d of %d keys in cache", len([value for value in data if not isinstance(value, type(None))]), len(data))
+                    socket.send(json.dumps({ "result": data, "error": None }).encode('utf-8'))
+                else:
+                    LOGGER.warning("skipping - keys are missing: %s", json.dumps(jmsg))
+                    socket.send(json.dumps({
+                        "result": None,
+                        "error": "keys missing in message"
+                    }).encode('utf-8'))
+                    continue
+
+            elif jmsg['cmd'] == 'mset':
+                if (isinstance(jmsg.get('keys', None), list) and isinstance(jmsg.get('values', None), list)
+                    and len(jmsg['keys']) == len(jmsg['values'])):
+                    try:
+                        cache_keys = [cacheKey(key) for key in jmsg['keys']]
+                    except Exception as excep:
+                        LOGGER.warning("skipping - could not create cache_key: %s", str(excep))
+                        socket.send(json.dumps({
+                            "result": None,
+                            "error": "could not create (internal) cache_key"
+                        }).encode('utf-8'))
+                        continue
+                    try:
+                        cache.putmany(ns, zip(cache_keys, jmsg['values']))
+                    except Exception as excep:
+                        LOGGER.warning("Could not store on disc: %s",str(excep))
+                        socket.send(json.dumps({
+                            "result": None,
+                            "error": "could not store values"
+                        }).encode('utf-8'))
+                        continue
+
+                    socket.send(json.dumps({ "result": "ACK", "error": None }).encode('utf-8'))
+                else:
+                    LOGGER.warning("skipping - keys or values are missing or of different length: %s", json.dumps(jmsg))
+                    socket.send(json.dumps({
+                        "result": None,
+                        "error": "keys or values missing in message"
+                    }).encode('utf-8'))
+                    continue
+
+            elif jmsg['cmd'] == 'stats':
+                stats = writer.namespaceStats()
+                if 'ns' in jmsg:
+                    stats = { ns: stats.get(ns, {}) }
+                socket.send(json.dumps({ "result": stats, "error": None }).encode('utf-8'))
+
+            elif jmsg['cmd'] == 'drop':
+                if 'ns' in jmsg:
+                    writer.drop(ns)
+                    socket.send(json.dumps({ "result": "ACK", "error": None }).encode('utf-8'))
+                else:
+                    LOGGER.warning("skipping - ns is missing: %s", json.dumps(jmsg))
+                    socket.send(json.dumps({
+                        "result": None,
+                        "error": "ns missing in message"
+                    }).encode('utf-8'))
+                    continue
+
             else:
                 LOGGER.warning("skipping - unknown cmd found in message: %s", json.dumps(jmsg))
                 socket.send(json.dumps({
@@ -129,11 +697,34 @@ def main(args):
             LOGGER.warning("skipping - no cmd found in message: %s", json.dumps(jmsg))
             socket.send(json.dumps({
                 "result": None,
-                "error": str(excep)
+                "error": "no cmd found in message"
             }).encode('utf-8'))
             continue
     
 
+def main(args):
+    writer = CacheWriter(args)
+    writer.start()
+
+    context = zmq.Context()
+    # clients -> router -> dealer -> reader-threads
+    frontend = context.socket(zmq.ROUTER)
+    frontend.bind(args.zmqsocket)
+    backend = context.socket(zmq.DEALER)
+    backend.bind(READER_ENDPOINT)
+    for idx in range(args.readers):
+        threading.Thread(target=readerThread, args=(context, writer, args), daemon=True).start()
+
+    # systemd stops us via SIGTERM - write what is queued before leaving
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    LOGGER.info("Starting mainloop with %d readers", args.readers)
+    try:
+        zmq.proxy(frontend, backend)
+    finally:
+        LOGGER.info("stopping - writing the queued stores")
+        writer.stop()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         formatter_class = RawTextDefaultsHelpFormatter,
@@ -146,9 +737,26 @@ provides a key-value cache via zmq. it accepts json in the form:
         on cmd='store' '{"result": "<ACK|null>", "error": <null|problem>}' is send to conform or deny cachestoreage
         on cmd='retrieve' '{"result": <data|null>}, "error": <null|problem>}' is send. null is a cachemiss
 
+        several keys are stored or retrieved at once with
+        { "cmd" "mset", "keys": [data, ...], "values": [data, ...] } -> the same reply as 'store'
+        { "cmd" "mget", "keys": [data, ...] } -> '{"result": [<data|null>, ...], "error": <null|problem>}'
+
         'key' needs to be a string. From that string a uuid5-string is generated and used as the
         internal cachekey
 
+        the cache is a sqlite-database that is read via mmap. an old ndjson-cachefile is
+        imported with './cacheTool.py import'. the size of the cache is limited online by
+        '--maxentries' and '--maxbytes'
+
+        every request may carry a namespace '"ns": "<namespace>"' - e.g. a fingerprint of the model.
+        every namespace has a database, limits and stats of its own. requests without one use the
+        default namespace.
+        { "cmd" "stats" } -> '{"result": {"<namespace>": {"entries": .., "hits": .., ..}, ..}, "error": null}'
+        { "cmd" "drop", "ns": "<namespace>" } -> removes the whole namespace
+
+        requests are answered by '--readers' threads concurrently. stores are written to disc by
+        a writer-thread
+
         if anything fails a error not null is returned
         
         """,
@@ -160,14 +768,60 @@ provides a key-value cache via zmq. it accepts json in the form:
                         help = 'set the loglevel')
 
     parser.add_argument('--cache', type = str,
-                        default = "data/cache_data.ndjson",
-                        help = "where to find and maintain a (precomputed) cache. everything that is found in the cache is served no matter the used model - if the model is changed a new cachefile should be used")
+                        default = "data/cache.sqlite",
+                        help = "where to find and maintain a (precomputed) cache. this is the database of the default namespace, the other namespaces are kept next to it as <cache>.<namespace>.sqlite")
+    parser.add_argument('--mmapsize', type = int,
+                        default = 1 << 30,
+                        help = "map up to this amount of bytes of the cachefile into memory. reads within that size are served from the page-cache without a copy. 0 disables mmap")
+
+    parser.add_argument('--maxentries', type = int,
+                        default = 0,
+                        help = "evict entries once the cache holds more then this amount of entries. 0 is unlimited")
+    parser.add_argument('--maxbytes', type = int,
+                        default = 0,
+                        help = "evict entries once the keys and values in the cache are larger then this amount of bytes. 0 is unlimited")
+    parser.add_argument('--namespacebudget', type = str, nargs='*',
+                        default = [],
+                        help = "'<namespace>:<maxentries>:<maxbytes>' - limits for a namespace other then '--maxentries' and '--maxbytes'. 0 is unlimited")
+    parser.add_argument('--eviction', type = str,
+                        choices=['lru','lfu'],
+                        default = 'lru',
+                        help = "lru: evict the entries that were not looked up for the longest time. lfu: evict the entries with the fewest lookups first - the oldest of them first")
+    parser.add_argument('--maintenanceinterval', type = float,
+                        default = 5.0,
+                        help = "seconds between writing the access-times of lookups, evicting and freeing the space of evicted entries")
+
+    parser.add_argument('--readers', type = int,
+                        default = 4,
+                        help = "the amount of threads that answer requests concurrently. stores are written to disc by a thread of its own")
+
+    parser.add_argument('--codec', type = str,
+                        choices=['auto','zstd','zlib','json'],
+                        default = 'auto',
+                        help = "how new values are stored. zstd: zstd-compressed msgpack (needs msgpack and zstandard). zlib: zlib-compressed json. json: plain json. auto is zstd if available, zlib otherwise. values in any encoding are read")
+    parser.add_argument('--writebatch', type = int,
+                        default = 1000,
+                        help = "write the queued stores in one transaction once this amount of entries is reached")
+    parser.add_argument('--writedelay', type = float,
+                        default = 100,
+                        help = "write the queued stores at the latest this amount of milliseconds after the first one")
+    parser.add_argument('--durability', type = str,
+                        choices=['none','periodic','batch'],
+                        default = 'periodic',
+                        help = "none: never sync to disc - a crash of the os may lose or damage the cache. periodic: sync every 'fsyncinterval' seconds - a crash of the os loses the stores since. batch: sync every written batch. stores are acknowledged before they are written in any case")
+    parser.add_argument('--fsyncinterval', type = float,
+                        default = 1.0,
+                        help = "seconds between syncs with the periodic durability")
 
     parser.add_argument('--zmqsocket', type = str,
                         default = "ipc:///tmp/cache.ipc",
                         help = "the socket to bind to and wait for requests. for tcp use 'tcp://localhost:5559'. Remember to configure the clients appropriate")
 
     args = parser.parse_args()
+    args.budgets = {}
+    for budget in args.namespacebudget:
+        namespace, maxentries, maxbytes = budget.split(":")
+        args.budgets[namespace] = (int(maxentries), int(maxbytes))
 
     # set loglevel
     numeric_level = getattr(logging, args.log.upper(), logging.DEBUG)
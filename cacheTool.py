@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from cacheServer import (LOGGER, RawTextDefaultsHelpFormatter, SqliteStore, cacheKey, namespacePath, namespaces,
+                         encodeValue, decodeValue, defaultCodec, DEFAULT_NAMESPACE)
+
+
+def ndjsonItems(path):
+    """
+    the (key, value)-pairs of an old ndjson-cachefile. the cacheServer wrote
+    '{"<sentence>": <value>}'-lines, older files may have '{"key": .., "value": ..}'-lines
+    """
+    with open(path) as fp:
+        for number, line in enumerate(fp):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except Exception as excep:
+                LOGGER.warning("skipping line %d of %s: %s", number + 1, path, str(excep))
+                continue
+            if set(entry) == set(['key', 'value']):
+                yield entry['key'], entry['value']
+            else:
+                for key, value in entry.items():
+                    yield key, value
+
+def importCache(args):
+    """
+    import ndjson-cachefiles in the given order - later entries of the same key win
+    """
+    path = namespacePath(args.cache, args.namespace)
+    cache = SqliteStore(path)
+    for filename in args.files:
+        count = 0
+        items = []
+        for key, value in ndjsonItems(filename):
+            items.append((cacheKey(key), value))
+            if len(items) >= args.batchsize:
+                cache.putmany(items)
+                count = count + len(items)
+                items = []
+                LOGGER.info("imported %d entries of %s", count, filename)
+        cache.putmany(items)
+        count = count + len(items)
+        LOGGER.warning("imported %d entries of %s", count, filename)
+    LOGGER.warning("%d entries in %s", len(cache), path)
+    cache.close()
+
+def snapshotRows(args, namespace, cutoff):
+    """
+    the (key, value, size, atime, hits)-rows of a namespace in the snapshot - streamed from
+    the ndjson-cachefiles and the cache. later rows of the same key win
+    """
+    if namespace == args.ndjsonnamespace:
+        for filename in args.ndjson:
+            # the lines carry no time - they are as old as the file
+            atime = os.path.getmtime(filename)
+            if atime < cutoff:
+                LOGGER.warning("skipping %s - older than maxage", filename)
+                continue
+            for key, value in ndjsonItems(filename):
+                data = encodeValue(value, args.codec)
+                yield cacheKey(key), data, len(cacheKey(key)) + len(data), atime, 0
+
+    path = namespacePath(args.cache, namespace)
+    if not os.path.exists(path):
+        return
+    source = sqlite3.connect("file:%s?mode=ro" % (path), uri=True)
+    # one transaction - a consistent view even if the cacheServer keeps writing
+    source.execute("BEGIN")
+    cursor = source.execute("SELECT key, value, size, atime, hits FROM cache WHERE atime >= ?", (cutoff,))
+    while True:
+        rows = cursor.fetchmany(args.batchsize)
+        if len(rows) == 0:
+            break
+        for key, value, size, atime, hits in rows:
+            if args.recode:
+                value = encodeValue(decodeValue(value), args.codec)
+                size = len(key) + len(value)
+            yield key, value, size, atime, hits
+    source.close()
+
+def compactCache(args):
+    """
+    write a compacted snapshot of the cache: deduplicated, without the dropped namespaces and
+    the entries older than maxage, vacuumed and analyzed. every namespace is written to a
+    temporary file first and renamed when it is complete
+    """
+    assert os.path.abspath(args.output) != os.path.abspath(args.cache), "the snapshot has to be written next to the cache - not over it"
+    # encodeValue without a codec writes plain json
+    args.codec = args.codec or defaultCodec()
+    cutoff = time.time() - args.maxage * 86400 if args.maxage > 0 else 0
+    selected = set(namespaces(args.cache))
+    if len(args.ndjson) > 0:
+        selected.add(args.ndjsonnamespace)
+    selected = sorted(selected - set(args.dropnamespace))
+
+    for namespace in selected:
+        path = namespacePath(args.output, namespace)
+        temporary = path + ".tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        # creates the schema and the indices of the cacheServer
+        SqliteStore(temporary, codec=args.codec).close()
+        snapshot = sqlite3.connect(temporary)
+        snapshot.execute("PRAGMA journal_mode=OFF")
+        snapshot.execute("PRAGMA synchronous=OFF")
+
+        count = 0
+        rows = []
+        for row in snapshotRows(args, namespace, cutoff):
+            rows.append(row)
+            if len(rows) >= args.batchsize:
+                with snapshot:
+                    snapshot.executemany("INSERT OR REPLACE INTO cache (key, value, size, atime, hits) VALUES (?, ?, ?, ?, ?)", rows)
+                count = count + len(rows)
+                rows = []
+        with snapshot:
+            snapshot.executemany("INSERT OR REPLACE INTO cache (key, value, size, atime, hits) VALUES (?, ?, ?, ?, ?)", rows)
+        count = count + len(rows)
+
+        entries, size = snapshot.execute("SELECT count(*), total(size) FROM cache").fetchone()
+        LOGGER.info("vacuuming snapshot of namespace %s", namespace)
+        snapshot.execute("VACUUM")
+        snapshot.execute("ANALYZE")
+        # a single file - the cacheServer switches to its write-ahead-log on start
+        snapshot.execute("PRAGMA journal_mode=DELETE")
+        snapshot.close()
+        os.replace(temporary, path)
+        LOGGER.warning("namespace %s: %d rows read, %d entries with %d bytes written to %s", namespace, count, entries, size, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        formatter_class = RawTextDefaultsHelpFormatter,
+        description="""
+maintenance of the sqlite-cache of the cacheServer.
+
+import: imports old ndjson-cachefiles (one '{"<sentence>": <value>}' per line) into the
+        cache. the cacheServer may keep running in the meantime.
+compact: writes a snapshot of the cache to '--output' - deduplicated, without dropped namespaces
+        and old entries and vacuumed. the memory used does not depend on the size of the cache.
+        the cacheServer may keep running while the snapshot is written. to serve the snapshot
+        stop it, move the snapshot over the cache (or point '--cache' at it) and start it again.
+        """,
+        epilog = """
+        """)
+    parser.add_argument('--log', type = str,
+                        choices=['debug','info','warning','error','critical'],
+                        default='warning',
+                        help = 'set the loglevel')
+    parser.add_argument('--cache', type = str,
+                        default = "data/cache.sqlite",
+                        help = "the cache of the cacheServer")
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    importparser = commands.add_parser('import',
+                                       formatter_class = RawTextDefaultsHelpFormatter,
+                                       help = "import ndjson-cachefiles")
+    importparser.add_argument('files', type = str, nargs = '+',
+                              help = "the ndjson-cachefiles - imported in this order")
+    importparser.add_argument('--namespace', type = str,
+                              default = DEFAULT_NAMESPACE,
+                              help = "import into this namespace of the cache")
+    importparser.add_argument('--batchsize', type = int,
+                              default = 10000,
+                              help = "store this amount of entries per transaction")
+    importparser.set_defaults(function = importCache)
+
+    compactparser = commands.add_parser('compact',
+                                        formatter_class = RawTextDefaultsHelpFormatter,
+                                        help = "write a compacted snapshot of the cache")
+    compactparser.add_argument('--output', type = str,
+                               required = True,
+                               help = "the snapshot - the other namespaces are written next to it like in the cache")
+    compactparser.add_argument('--dropnamespace', type = str, nargs = '*',
+                               default = [],
+                               help = "leave these namespaces out")
+    compactparser.add_argument('--maxage', type = float,
+                               default = 0,
+                               help = "leave out entries that were not stored or looked up for this amount of days. entries of caches older than the eviction never were. 0 keeps all")
+    compactparser.add_argument('--ndjson', type = str, nargs = '*',
+                               default = [],
+                               help = "old ndjson-cachefiles to add - in this order. the entries of the cache win")
+    compactparser.add_argument('--ndjsonnamespace', type = str,
+                               default = DEFAULT_NAMESPACE,
+                               help = "the namespace of the ndjson-cachefiles")
+    compactparser.add_argument('--codec', type = str,
+                               choices=['zstd','zlib','json'],
+                               default = None,
+                               help = "encoding of the values from ndjson-cachefiles and with '--recode'. If None is given zstd if available, zlib otherwise")
+    compactparser.add_argument('--recode', action = 'store_true',
+                               help = "encode the values of the cache with '--codec' too, e.g. to compress the plain json of old caches")
+    compactparser.add_argument('--batchsize', type = int,
+                               default = 10000,
+                               help = "read and write this amount of entries at once")
+    compactparser.set_defaults(function = compactCache)
+
+    args = parser.parse_args()
+
+    # set loglevel
+    numeric_level = getattr(logging, args.log.upper(), logging.DEBUG)
+    LOGGER.setLevel(numeric_level)
+
+    args.function(args)
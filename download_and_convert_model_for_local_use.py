@@ -1,8 +1,22 @@
+import argparse
+
 import flair
 import torch
 from flair.nn import Classifier
 import spacy
 
+from modelServer import quantizeModel, saveFastArtifact
+
+parser = argparse.ArgumentParser(
+    description="download the models and store them for local use")
+parser.add_argument('--fastartifact', action='store_true',
+                    help = "also store the flair-models as fast-start artifact (a directory ending on '.fast') that the modelServer loads via mmap")
+parser.add_argument('--quantize', type = str,
+                    choices=['none','dynamic-int8'],
+                    default = "none",
+                    help = "also store a quantized copy of the flair-models as fast-start artifact (ending on '.int8.fast') that the modelServer can load directly")
+args = parser.parse_args()
+
 # dont' load the model to gpu 
 device = torch.device('cpu')
 flair.device = device
@@ -15,6 +29,16 @@ flair.device = device
 ner_tagger = Classifier.load('ner-ontonotes-large')
 ner_tagger.save("models/ner-english-ontonotes-large.bin")
 
+if args.fastartifact:
+    saveFastArtifact(ner_tagger, "models/ner-english-ontonotes-large.fast",
+                     {"source": "ner-ontonotes-large", "quantize": "none"})
+
+if args.quantize != "none":
+    # quantized modules can't be restored via Classifier.load - store the whole module
+    ner_tagger = quantizeModel(ner_tagger, args.quantize)
+    saveFastArtifact(ner_tagger, "models/ner-english-ontonotes-large.int8.fast",
+                     {"source": "ner-ontonotes-large", "quantize": args.quantize})
+
 del ner_tagger
 
 #ner_tagger_tpu = Classifier.load('hmteams/flair-hipe-2022-ajmc-de')
@@ -39,5 +63,6 @@ del ner_tagger
 
 
 # used for sentence-split at the split-server and for cleanup at the middleServer
+# spacy can't be mapped into memory - the servers skip loading the components they don't use (see '--exclude')
 nlp = spacy.load("de_dep_news_trf")
 nlp.to_disk("./models/de_dep_news_trf.bin")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import logging
+import argparse
+import time
+
+from modelServer import LOGGER, RawTextDefaultsHelpFormatter, doModel, setupModel
+
+
+def entities(result):
+    """
+    the set of (start, end, label) of all entities of one model-result
+    """
+    found = set()
+    for entity in result.get('entities', []):
+        found.add((entity['start_pos'], entity['end_pos'], entity['labels'][0]['value']))
+    return found
+
+def labels(result):
+    """
+    the set of labels of one model-result (TextClassifier)
+    """
+    return set([label['value'] for label in result.get('labels', [])])
+
+def runModel(model, texts, args):
+    """
+    returns the results of the model on all texts and the sentences per second
+    """
+    # the first batch pays for the lazy initialisation - don't measure it
+    doModel(model, texts[:args.maxbatchsize], args)
+
+    results = []
+    start = time.time()
+    for offset in range(0, len(texts), args.maxbatchsize):
+        results.extend(doModel(model, texts[offset:offset + args.maxbatchsize], args))
+    duration = time.time() - start
+
+    return results, len(texts) / duration
+
+def main(args):
+    with open(args.corpus) as fp:
+        texts = [line.strip() for line in fp if line.strip()]
+    if args.maxsentences > 0:
+        texts = texts[:args.maxsentences]
+
+    quantize = args.quantize
+    args.quantize = "none"
+    model, device = setupModel(args)
+    assert not isinstance(model, type(None)), "Model could not be loaded"
+    LOGGER.info("running fp32-model on %d sentences", len(texts))
+    reference, referencespeed = runModel(model, texts, args)
+    del model
+
+    if args.quantizedmodel:
+        args.model = args.quantizedmodel
+    args.quantize = quantize
+    # the threads are already limited - torch refuses to set the interop-threads twice
+    args.threads = 0
+    model, device = setupModel(args)
+    assert not isinstance(model, type(None)), "quantized Model could not be loaded"
+    LOGGER.info("running quantized model on %d sentences", len(texts))
+    quantized, quantizedspeed = runModel(model, texts, args)
+
+    same = 0
+    common = 0
+    referencecount = 0
+    quantizedcount = 0
+    for expected, got in zip(reference, quantized):
+        expected = entities(expected) | labels(expected)
+        got = entities(got) | labels(got)
+        if expected == got:
+            same = same + 1
+        common = common + len(expected & got)
+        referencecount = referencecount + len(expected)
+        quantizedcount = quantizedcount + len(got)
+
+    precision = common / max(quantizedcount, 1)
+    recall = common / max(referencecount, 1)
+    print("sentences:                 %d" % (len(texts)))
+    print("identical output:          %d (%.1f%%)" % (same, 100 * same / max(len(texts), 1)))
+    print("entities/labels fp32:      %d" % (referencecount))
+    print("entities/labels quantized: %d" % (quantizedcount))
+    print("precision vs fp32:         %.4f" % (precision))
+    print("recall vs fp32:            %.4f" % (recall))
+    print("f1 vs fp32:                %.4f" % (2 * precision * recall / max(precision + recall, 1e-9)))
+    print("fp32 sentences/s:          %.2f" % (referencespeed))
+    print("quantized sentences/s:     %.2f" % (quantizedspeed))
+    print("speedup:                   %.2fx" % (quantizedspeed / referencespeed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        formatter_class = RawTextDefaultsHelpFormatter,
+        description="""
+compares the output and the speed of a quantized model against the fp32-model on the cpu.
+the corpus is a textfile with one sentence per line. the entities (and labels of a
+TextClassifier) of the quantized model are compared against the fp32-model, which
+is taken as the truth.
+        """,
+        epilog = """
+        """)
+    parser.add_argument('--log', type = str,
+                        choices=['debug','info','warning','error','critical'],
+                        default='warning',
+                        help = 'set the loglevel')
+    parser.add_argument('--corpus', type = str,
+                        required = True,
+                        help = "textfile with one sentence per line")
+    parser.add_argument('--maxsentences', type = int,
+                        default = 0,
+                        help = "only use the first sentences of the corpus. 0 uses all")
+    parser.add_argument('--model', type = str,
+                        default = "models/ner-english-ontonotes-large.bin",
+                        help = "the fp32-model")
+    parser.add_argument('--quantizedmodel', type = str,
+                        default = None,
+                        help = "an already quantized fast-start artifact (ending on '.int8.fast'). If None is given the fp32-model is quantized after loading")
+    parser.add_argument('--quantize', type = str,
+                        choices=['dynamic-int8'],
+                        default = "dynamic-int8",
+                        help = "the kind of quantization to compare against")
+    parser.add_argument('--threads', type = int,
+                        default = 0,
+                        help = "limit the amount of CPU-threads that can be used; 0 is equivalent to the number of CPUs in the system")
+    parser.add_argument('--maxbatchsize', type = int,
+                        default = 32,
+                        help = "the amount of sentences given to the model at once")
+    parser.add_argument('--minibatchsize', type = int,
+                        default = 32,
+                        help = "the mini_batch_size passed to the model-prediction")
+
+    args = parser.parse_args()
+    # the settings of the modelServer that are not relevant here
+    args.device = "cpu"
+    args.keepcudacache = False
+    args.nobucketing = False
+
+    # set loglevel
+    numeric_level = getattr(logging, args.log.upper(), logging.DEBUG)
+    LOGGER.setLevel(numeric_level)
+
+    main(args)
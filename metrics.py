@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+minimal prometheus-metrics for the broker and the workers. the metrics are served
+in the prometheus text format via http on '/metrics' by a daemon-thread.
+"""
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds - from a fast cpu-split up to a long text on a busy worker
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# amount of texts/requests per batch
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+# bytes of a text
+BYTE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536)
+
+
+def formatLabels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if not isinstance(extra, type(None)):
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                           for name, value in pairs]) + "}"
+
+
+class Metric(object):
+    """a counter or gauge - optionally with labels or a function that returns the value"""
+
+    def __init__(self, name, documentation, kind, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def samples(self):
+        if not isinstance(self.function, type(None)):
+            # the function returns a value or a dict of labelvalues -> value
+            values = self.function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return ["%s%s %s" % (self.name, formatLabels(self.labelnames, labelvalues), repr(float(value)))
+                for labelvalues, value in values.items()]
+
+
+class Histogram(object):
+    """a histogram with fixed buckets - optionally with labels"""
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = "histogram"
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # labelvalues -> [count per bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            counts, total, count = self.values.get(labelvalues, ([0] * len(self.buckets), 0.0, 0))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] = counts[idx] + 1
+            self.values[labelvalues] = (counts, total + value, count + 1)
+
+    def remove(self, *labelvalues):
+        with self.lock:
+            self.values.pop(labelvalues, None)
+
+    def samples(self):
+        with self.lock:
+            values = dict([(labelvalues, (list(counts), total, count))
+                           for labelvalues, (counts, total, count) in self.values.items()])
+        lines = []
+        for labelvalues, (counts, total, count) in values.items():
+            for bound, bucketcount in zip(self.buckets, counts):
+                lines.append("%s_bucket%s %d" % (self.name, formatLabels(self.labelnames, labelvalues, ("le", repr(float(bound)))), bucketcount))
+            lines.append("%s_bucket%s %d" % (self.name, formatLabels(self.labelnames, labelvalues, ("le", "+Inf")), count))
+            lines.append("%s_sum%s %s" % (self.name, formatLabels(self.labelnames, labelvalues), repr(total)))
+            lines.append("%s_count%s %d" % (self.name, formatLabels(self.labelnames, labelvalues), count))
+        return lines
+
+
+class Registry(object):
+    """all metrics of one process"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Metric(name, documentation, "counter", labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Metric(name, documentation, "gauge", labelnames, function))
+
+    def histogram(self, name, documentation, buckets=TIME_BUCKETS, labelnames=()):
+        return self.register(Histogram(name, documentation, buckets, labelnames))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception as excep:
+                LOGGER.warning("could not collect metric %s: %s", metric.name, str(excep))
+                continue
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            lines.extend(samples)
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+def startMetricsServer(registry, host, port):
+    """serve the metrics of the registry on http://host:port/metrics in a daemon-thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+            body = registry.render()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            LOGGER.debug("metrics-request: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    LOGGER.info("serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -3,9 +3,12 @@
 import logging
 import argparse
 import json
+import sys
 from collections import defaultdict
 from random import randint
 import time
+import threading
+import queue
 
 import zmq
 
@@ -13,6 +16,8 @@ import spacy
 
 import torch
 
+from metrics import Registry, startMetricsServer, BYTE_BUCKETS
+
 
 # configure logging and LOGGER
 logging.basicConfig(format='%(asctime)s %(name)s' +
@@ -29,13 +34,40 @@ PPP_HEARTBEAT = b"\x02"  # Signals worker heartbeat
 INTERVAL_INIT = 1
 INTERVAL_MAX = 32
 
+# (phase, seconds) of the startup - reported once the worker is registered
+STARTUP_PHASES = []
+
+# the io-thread passes requests to the compute-threads via a queue - the next idle
+# thread takes the next request - and gets the replies back via this socket
+RESULT_ENDPOINT = "inproc://results"
+
+# served via http with '--metricsport'
+METRICS = Registry()
+INFERENCE_SECONDS = METRICS.histogram("ner_middleware_inference_seconds", "seconds the middleware-model needed for one request")
+REQUEST_BYTES = METRICS.histogram("ner_middleware_request_bytes", "bytes per request given to the model", BYTE_BUCKETS)
+INFERENCE_ERRORS = METRICS.counter("ner_middleware_errors_total", "requests the model failed on")
+
 # argparse magic
 class RawTextDefaultsHelpFormatter(argparse.RawDescriptionHelpFormatter,
                                    argparse.ArgumentDefaultsHelpFormatter):
     pass
 
+def startupPhase(phase, start):
+    """
+    note the duration of a startup phase that began at 'start'. returns the current time
+    """
+    now = time.time()
+    STARTUP_PHASES.append((phase, now - start))
+    return now
+
+def reportStartup():
+    for phase, duration in STARTUP_PHASES:
+        LOGGER.info("startup phase %-12s %8.2fs", phase, duration)
+    LOGGER.info("startup total        %8.2fs", sum([duration for phase, duration in STARTUP_PHASES]))
+
 def setupMiddleware(args):
     model = None
+    start = time.time()
 
     LOGGER.debug("Setting device")
 
@@ -47,10 +79,12 @@ def setupMiddleware(args):
         spacy.require_gpu(args.deviceid)
 
     LOGGER.info("Device set to %s",str(args.device))
+    start = startupPhase("device", start)
 
     LOGGER.info("Loading model")
     try:
-        model = spacy.load(args.model, disable=["ner"])
+        model = spacy.load(args.model, exclude=args.exclude)
+        startupPhase("load model", start)
     except Exception as excep:
         LOGGER.critical("Failed to load model: %s",str(excep))
     finally:
@@ -77,7 +111,7 @@ def setupSocket(args,poller, prefix=None):
 
         socket.connect(args.zmqsocket)
         LOGGER.info("announcing myself to Broker as: %s" %(identity.decode()))
-        socket.send(PPP_READY)
+        socket.send_multipart([PPP_READY, workerInfo(args)])
 
     except Exception as excep:
         LOGGER.critical("Could not connect to zmq-broker:%s",str(excep))
@@ -130,6 +164,87 @@ def doMiddleware(model, data, args):
 
     return result
 
+def workerInfo(args):
+    """
+    send with READY and HEARTBEAT to the broker. the broker keeps up to 'credit' requests
+    in flight at this worker. the prefetched requests wait in the work-queue until a
+    compute-thread is free
+    """
+    return json.dumps({ "credit": args.computethreads + args.prefetch }).encode('utf-8')
+
+def handleRequest(socket, model, frames, args):
+    """
+    decode a 3-part request, run the model and send the reply via socket
+    """
+    address, empty, request = frames
+
+    try:
+        jmsg = json.loads(request.decode("utf-8"))
+    except Exception as excep:
+        LOGGER.warning("could not decode json message from socket: %s",str(excep))
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "could not decode json message from socket"
+                               }).encode('utf-8')])
+        return
+
+    if not isinstance(jmsg, dict):
+        LOGGER.warning("skipping: message is not a json-object")
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "message is not a json-object"
+                               }).encode('utf-8')])
+        return
+
+    if 'data' not in jmsg:
+        LOGGER.warning("skipping: no data in message")
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "no data in message"
+                               }).encode('utf-8')])
+        return
+
+    LOGGER.debug("starting processing:")
+    REQUEST_BYTES.observe(len(request))
+    start = time.time()
+    try:
+        result = doMiddleware(model, jmsg['data'], args)
+    except Exception as excep:
+        LOGGER.warning("predition failed: %s",str(excep))
+        INFERENCE_ERRORS.inc()
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "prediction failed - check server"
+                               }).encode('utf-8')])
+        return
+    INFERENCE_SECONDS.observe(time.time() - start)
+
+    LOGGER.debug("done prediction")
+    socket.send_multipart([address, b'',
+                           json.dumps({
+                               "result": result,
+                               "error": None
+                           }).encode('utf-8')])
+
+def computeThread(context, work, model, args):
+    """
+    runs the model on the requests the io-thread passes on and hands the replies
+    back to it. the io-thread keeps heartbeating in the meantime
+    """
+    results = context.socket(zmq.PUSH)
+    results.connect(RESULT_ENDPOINT)
+
+    while True:
+        try:
+            handleRequest(results, model, work.get(), args)
+        except Exception as excep:
+            # the thread must not die - the io-thread keeps heartbeating for it
+            LOGGER.exception("could not handle request: %s", str(excep))
+
 def main(args):
 
     poller = zmq.Poller()
@@ -137,18 +252,34 @@ def main(args):
     model = setupMiddleware(args)
     assert not isinstance(model, type(None)), "could not setup model for middleware"
 
+    # the io-thread (this one) owns the socket to the broker. requests are passed on to
+    # the compute-threads and their replies are collected via inproc-sockets
+    context = zmq.Context()
+    work = queue.Queue()
+    results = context.socket(zmq.PULL)
+    results.bind(RESULT_ENDPOINT)
+    computethreads = [threading.Thread(target=computeThread, args=(context, work, model, args), daemon=True)
+                      for idx in range(args.computethreads)]
+    for thread in computethreads:
+        thread.start()
+
+    poller.register(results, zmq.POLLIN)
+
+    if args.metricsport > 0:
+        startMetricsServer(METRICS, args.metricshost, args.metricsport)
+
+    start = time.time()
     socket = setupSocket(args, poller, prefix="%s-%s" %(args.device, str(args.deviceid)))
     assert not isinstance(socket, type(None)), "ZeroMQ Socket coult not be created"
+    startupPhase("connect", start)
+    reportStartup()
 
-    liveness = args.heartbeatliveness
     interval = INTERVAL_INIT
     
     heartbeat_at = time.time() + args.heartbeatinterval
+    broker_expiry = time.time() + args.heartbeatinterval * args.heartbeatliveness
        
     while True:
-        result = []
-        jmsg = None
-
         # waiting for a message
         socks = dict(poller.poll(args.heartbeatinterval * 1000))
 
@@ -165,75 +296,40 @@ def main(args):
             if len(frames) == 1 and frames[0] == PPP_HEARTBEAT:
                 LOGGER.debug("Heartbeat from broker")
 
-                liveness = args.heartbeatliveness
-
-            # regular work request from a client
+            # regular work request from a client - pass it on to the compute-threads
             elif len(frames) == 3:
-                address, empty, request = frames
-                liveness = args.heartbeatliveness
-        
-                try:
-                    jmsg = json.loads(request.decode("utf-8"))
-                except Exception as excep:
-                    LOGGER.warning("could not decode json message from socket: %s",str(excep))
-                    socket.send_multipart([address, b'',
-                                           json.dumps({
-                                               "result": None,
-                                               "error": "could not decode json message from socket"
-                                           }).encode('utf-8')])
-                    continue
-
-                if 'data' not in jmsg:
-                    LOGGER.warning("skipping: no data in message")
-                    socket.send_multipart([address, b'',
-                                           json.dumps({
-                                               "result": None,
-                                               "error": "no data in message"
-                                           }).encode('utf-8')])
-            
-                    continue
-
-                LOGGER.debug("starting processing:")
-                data = jmsg['data']
-                try:
-                    result = doMiddleware(model, jmsg['data'], args)
-                except Exception as excep:
-                    LOGGER.warning("predition failed: %s",str(excep))
-                    socket.send_multipart([address, b'',
-                                           json.dumps({
-                                               "result": None,
-                                               "error": "prediction failed - check server"
-                                           }).encode('utf-8')])
-                    continue
-            
-                LOGGER.debug("done prediction")
-                socket.send_multipart([address, b'',
-                               json.dumps({
-                                   "result": result,
-                                   "error": None
-                               }).encode('utf-8')])
+                work.put(frames)
             else:
                 LOGGER.error("Invalid message: %s",str(frames))
                 
+            broker_expiry = time.time() + args.heartbeatinterval * args.heartbeatliveness
             interval = INTERVAL_INIT
-        else:
-            liveness -= 1
-            if liveness == 0:
-                LOGGER.warning("Heartbeat failure, can't reach queue")
-                LOGGER.warning("Reconnecting in %0.2fs...", interval)
-                time.sleep(interval)
-
-                if interval < INTERVAL_MAX:
-                    interval *= 2
-                poller.unregister(socket)
-                socket.setsockopt(zmq.LINGER, 0)
-                socket.close()
-                socket = setupSocket(args, poller, prefix="%s-%s" %(args.device, str(args.deviceid)))
-                liveness = args.heartbeatliveness
+
+        # a compute-thread is done
+        if socks.get(results) == zmq.POLLIN:
+            socket.send_multipart(results.recv_multipart())
+
+        if time.time() > broker_expiry:
+            LOGGER.warning("Heartbeat failure, can't reach queue")
+            LOGGER.warning("Reconnecting in %0.2fs...", interval)
+            time.sleep(interval)
+
+            if interval < INTERVAL_MAX:
+                interval *= 2
+            poller.unregister(socket)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.close()
+            socket = setupSocket(args, poller, prefix="%s-%s" %(args.device, str(args.deviceid)))
+            broker_expiry = time.time() + args.heartbeatinterval * args.heartbeatliveness
         if time.time() > heartbeat_at:
+            # a worker without its compute-threads would only swallow requests - stop
+            # heartbeating, so the broker expires it, and get restarted
+            if not all([thread.is_alive() for thread in computethreads]):
+                LOGGER.critical("a compute-thread died - exiting")
+                sys.exit(1)
             heartbeat_at = time.time() + args.heartbeatinterval
             LOGGER.info("sending Worker heartbeat")
-            socket.send(PPP_HEARTBEAT)
+            socket.send_multipart([PPP_HEARTBEAT, workerInfo(args)])
 
 
 if __name__ == '__main__':
@@ -268,6 +364,10 @@ if "error" is not "null" something happend to the model and the "null"-result is
                         default = "./models/de_dep_news_trf.bin", # de_core_news_lg
                         help = "which model to use - needs to be installed via pip - check https://spacy.io/usage to download models for your hardware/language")
 
+    parser.add_argument('--exclude', type = str, nargs='*',
+                        default = ["ner","parser"],
+                        help = "components of the spacy-pipeline that are not loaded at all. the middleware only needs the tags and lemmas")
+
     parser.add_argument('--keepcudacache', action="store_true",
                         help = "keep the cachedata on the cuda-device. default is to drop the cache after prediction to free no longer used memory on the device")
     
@@ -275,6 +375,12 @@ if "error" is not "null" something happend to the model and the "null"-result is
                         default = 0.95,
                         help = 'every NER-Tag produced by the model comes with a confidence. with the nertaggermiddleware enabled, labes with a confidence lower then this value are ignored and filted out.')
 
+    parser.add_argument('--metricsport', type = int,
+                        default = 0,
+                        help = "serve prometheus-metrics via http on this port (path /metrics). 0 disables the metrics")
+    parser.add_argument('--metricshost', type = str,
+                        default = "127.0.0.1",
+                        help = "the address the metrics are served on. Use 0.0.0.0 for every ip")
     parser.add_argument('--zmqsocket', type = str,
                         default = "tcp://localhost:5562",
                         help = "where to find the zmq-proxy/broker to register as worker")
@@ -282,6 +388,12 @@ if "error" is not "null" something happend to the model and the "null"-result is
     parser.add_argument('--identityprefix', type = str,
                         default = None,
                         help = "set an identityprefix for zmq-worker-identityname. If None is given used device is choosen")
+    parser.add_argument('--computethreads', type = int,
+                        default = 1,
+                        help = "the amount of threads that run the model. the socket to the broker and the heartbeats are handled by a thread of its own")
+    parser.add_argument('--prefetch', type = int,
+                        default = 1,
+                        help = "ask the broker for this amount of requests in addition to one per computethread, so the next request is already waiting when the model is done")
     parser.add_argument('--heartbeatinterval', type = float,
                         default=2.0,
                         help = "interval of heartbeats for worker and clients in seconds")
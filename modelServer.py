@@ -3,6 +3,13 @@
 import logging
 import argparse
 import json
+import os
+import sys
+import signal
+import threading
+import queue
+import multiprocessing
+import multiprocessing.connection
 from collections import defaultdict
 from random import randint
 import time
@@ -16,6 +23,8 @@ from flair.data import Sentence
 
 import torch
 
+from metrics import Registry, startMetricsServer, SIZE_BUCKETS
+
 
 # configure logging and LOGGER
 logging.basicConfig(format='%(asctime)s %(name)s' +
@@ -31,14 +40,88 @@ PPP_HEARTBEAT = b"\x02"  # Signals worker heartbeat
 INTERVAL_INIT = 1
 INTERVAL_MAX = 32
 
+# fast-start artifact: a directory with the whole (pickled) module in a
+# memory-mappable tensorfile and a small config
+FASTARTIFACT_MODEL = "model.pt"
+FASTARTIFACT_CONFIG = "config.json"
+
+# the io-thread passes requests to the compute-threads via a queue - the next idle
+# thread takes the next request - and gets the replies back via this socket
+RESULT_ENDPOINT = "inproc://results"
+
+# (phase, seconds) of the startup - reported once the worker is registered
+STARTUP_PHASES = []
+
+# served via http with '--metricsport'
+METRICS = Registry()
+INFERENCE_SECONDS = METRICS.histogram("ner_model_inference_seconds", "seconds the model needed for one batch")
+BATCH_TEXTS = METRICS.histogram("ner_model_batch_texts", "sentences per batch given to the model", SIZE_BUCKETS)
+BATCH_REQUESTS = METRICS.histogram("ner_model_batch_requests", "requests per batch given to the model", SIZE_BUCKETS)
+INFERENCE_ERRORS = METRICS.counter("ner_model_errors_total", "batches the model failed on")
+
 # argparse magic
 class RawTextDefaultsHelpFormatter(argparse.RawDescriptionHelpFormatter,
                                    argparse.ArgumentDefaultsHelpFormatter):
     pass
 
 
+def startupPhase(phase, start):
+    """
+    note the duration of a startup phase that began at 'start'. returns the current time
+    """
+    now = time.time()
+    STARTUP_PHASES.append((phase, now - start))
+    return now
+
+def reportStartup():
+    for phase, duration in STARTUP_PHASES:
+        LOGGER.info("startup phase %-12s %8.2fs", phase, duration)
+    LOGGER.info("startup total        %8.2fs", sum([duration for phase, duration in STARTUP_PHASES]))
+
+def isFastArtifact(path):
+    return os.path.isfile(os.path.join(path, FASTARTIFACT_CONFIG))
+
+def saveFastArtifact(model, path, config):
+    """
+    store the whole model in a format that can be loaded via mmap - see loadFastArtifact
+    """
+    os.makedirs(path, exist_ok=True)
+    torch.save(model, os.path.join(path, FASTARTIFACT_MODEL))
+    config['torch'] = torch.__version__
+    config['flair'] = flair.__version__
+    config['class'] = "%s.%s" % (type(model).__module__, type(model).__name__)
+    with open(os.path.join(path, FASTARTIFACT_CONFIG), 'w') as fp:
+        json.dump(config, fp, indent=2)
+
+def loadFastArtifact(path, device):
+    """
+    the tensors are mapped into memory and only read from disk when they are used.
+    on the cpu several processes share the pages of the file
+    """
+    with open(os.path.join(path, FASTARTIFACT_CONFIG)) as fp:
+        config = json.load(fp)
+    if config['torch'] != torch.__version__ or config['flair'] != flair.__version__:
+        LOGGER.warning("artifact %s was created with torch %s/flair %s - running torch %s/flair %s",
+                       path, config['torch'], config['flair'], torch.__version__, flair.__version__)
+    model = torch.load(os.path.join(path, FASTARTIFACT_MODEL), mmap=True,
+                       map_location="cpu", weights_only=False)
+    model.to(device)
+    return model, config
+
+def quantizeModel(model, quantize):
+    """
+    apply pytorch dynamic quantization to the Linear- and LSTM-layers of the model.
+    only usable on the cpu
+    """
+    if quantize == "dynamic-int8":
+        LOGGER.info("Applying dynamic int8 quantization")
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear, torch.nn.LSTM},
+                                                    dtype=torch.qint8, inplace=True)
+    return model
+
 def setupModel(args):
     model = None
+    start = time.time()
     # limit number of threads
     if args.threads > 0:
         torch.set_num_threads(args.threads)
@@ -53,23 +136,64 @@ def setupModel(args):
         device = torch.device(args.device)
     flair.device = device
     LOGGER.info("Device set to %s",str(device))
+    start = startupPhase("device", start)
+
+    if args.quantize != "none" and device.type != "cpu":
+        LOGGER.warning("Quantization is only supported on the cpu - not quantizing the model for %s", str(device))
+        args.quantize = "none"
 
     LOGGER.info("Loading model")
     try:
-        model = Classifier.load(args.model)
+        if isFastArtifact(args.model):
+            model, config = loadFastArtifact(args.model, device)
+            start = startupPhase("load model", start)
+            # artifacts created by download_and_convert_model_for_local_use.py may be quantized already
+            if config.get('quantize', "none") == "none":
+                model = quantizeModel(model, args.quantize)
+        else:
+            model = Classifier.load(args.model)
+            start = startupPhase("load model", start)
+            model = quantizeModel(model, args.quantize)
+        model.eval()
+        start = startupPhase("quantize", start)
     except Exception as excep:
         LOGGER.critical("Failed to load model: %s",str(excep))
     finally:
         return model, device
 
-def doModel(model, text, args):
+def doModel(model, texts, args, stats=None):
+    """
+    run the model on a list of texts and return the results in the same order.
+    the sentences are sorted by their length and split into minibatches, so every
+    minibatch is only padded to similar long sentences. with 'nobucketing' the texts
+    are passed to the model as they are - flair sorts them by length by itself.
+    if stats is a list, (realtokens, paddedtokens) is appended for every minibatch
+    """
+    sentences = [Sentence(text) for text in texts]
+
+    if args.nobucketing:
+        if not isinstance(stats, type(None)):
+            # the minibatches flair builds: longest sentences first
+            lengths = sorted([len(sentence) for sentence in sentences], reverse=True)
+            for start in range(0, len(lengths), args.minibatchsize):
+                minibatch = lengths[start:start + args.minibatchsize]
+                stats.append((sum(minibatch), max(minibatch) * len(minibatch)))
+        model.predict(sentences, mini_batch_size=args.minibatchsize)
+    else:
+        order = sorted(range(len(sentences)), key=lambda idx: len(sentences[idx]))
+        for start in range(0, len(order), args.minibatchsize):
+            minibatch = [sentences[idx] for idx in order[start:start + args.minibatchsize]]
+            lengths = [len(sentence) for sentence in minibatch]
+            LOGGER.debug("minibatch of %d sentences: %d real tokens, %d padded tokens",
+                         len(minibatch), sum(lengths), max(lengths) * len(minibatch))
+            if not isinstance(stats, type(None)):
+                stats.append((sum(lengths), max(lengths) * len(minibatch)))
+            model.predict(minibatch, mini_batch_size=len(minibatch))
 
-    sentence = Sentence(text)
-    
-    model.predict(sentence)
-    LOGGER.info("done prediction")
-    
-    result = sentence.to_dict()
+    LOGGER.info("done prediction on %d sentences", len(sentences))
+
+    # the sentences are still in the original order
+    result = [sentence.to_dict() for sentence in sentences]
 
     # drop the cuda-cache
     if not args.keepcudacache and torch.cuda.is_available():
@@ -78,7 +202,207 @@ def doModel(model, text, args):
 
     return result
 
+def benchmark(model, args):
+    """
+    run the sentences of a file (one per line) through the model in batches of
+    'maxbatchsize' - plain model.predict and with bucketing - and report real vs.
+    padded tokens
+    """
+    with open(args.benchmark) as fp:
+        texts = [line.strip() for line in fp if line.strip()]
+
+    for name, nobucketing in [("model.predict", True), ("bucketing", False)]:
+        variant = argparse.Namespace(**vars(args))
+        variant.nobucketing = nobucketing
+        stats = []
+        start = time.time()
+        for offset in range(0, len(texts), args.maxbatchsize):
+            doModel(model, texts[offset:offset + args.maxbatchsize], variant, stats)
+        duration = time.time() - start
+
+        print(name)
+        for idx, (real, padded) in enumerate(stats):
+            print("  minibatch %4d: %6d real tokens %6d padded tokens (%5.1f%% padding)" %
+                  (idx, real, padded, 100 * (padded - real) / padded))
+        real = sum([real for real, padded in stats])
+        padded = sum([padded for real, padded in stats])
+        print("  total: %d sentences, %d real tokens, %d padded tokens (%.1f%% padding), %.2f sentences/s" %
+              (len(texts), real, padded, 100 * (padded - real) / max(padded, 1), len(texts) / duration))
+
+def warmupModel(model, args):
+    """
+    run synthetic sentences of different lengths through the model, so lazy
+    initialisations (cuda, mkl, allocator) are done before the first real request
+    """
+    words = "Anton Schwarz hat in Dresden eine Wohnung , die in dem Buch Traumwerkstadt beschrieben wird .".split()
+    texts = [" ".join([words[idx % len(words)] for idx in range(length)]) for length in args.warmuplengths]
+
+    start = time.time()
+    latencies = {}
+    for warmupround in range(args.warmuprounds):
+        for text in texts:
+            predictstart = time.time()
+            doModel(model, [text], args)
+            latencies[countTokens(text)] = time.time() - predictstart
+        # the batched path allocates differently
+        if args.batchwindow > 0:
+            doModel(model, texts, args)
+
+    LOGGER.info("warm-up took %0.2fs with %d rounds", time.time() - start, args.warmuprounds)
+    for length, latency in latencies.items():
+        LOGGER.info("steady-state latency for %d tokens: %0.1fms", length, latency * 1000)
+
+def countTokens(text):
+    """
+    cheap estimate of the amount of tokens - only used to limit the size of a batch
+    """
+    return len(text.split())
+
+def decodeRequest(socket, frames):
+    """
+    decode a 3-part request and check it. returns (address, texts, multi) or None if
+    the request was invalid - in that case the client already got the error.
+    'multi' is true if the client send '{"texts": [...]}' and expects '{"results": [...]}'
+    """
+    address, empty, request = frames
+    try:
+        jmsg = json.loads(request.decode("utf-8"))
+    except Exception as excep:
+        LOGGER.warning("could not decode json message from socket: %s",str(excep))
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "could not decode json message from socket"
+                               }).encode('utf-8')])
+        return None
+
+    if not isinstance(jmsg, dict):
+        LOGGER.warning("skipping: message is not a json-object")
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "message is not a json-object"
+                               }).encode('utf-8')])
+        return None
+
+    if 'texts' in jmsg and isinstance(jmsg['texts'], list):
+        if not all([isinstance(text, str) for text in jmsg['texts']]):
+            LOGGER.warning("skipping: texts are not all strings")
+            socket.send_multipart([address, b'',
+                                   json.dumps({
+                                       "results": None,
+                                       "error": "texts must be a list of strings"
+                                   }).encode('utf-8')])
+            return None
+        return address, jmsg['texts'], True
+
+    if 'text' not in jmsg:
+        LOGGER.warning("skipping: no text in message")
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "no text in message"
+                               }).encode('utf-8')])
+        return None
+
+    if not isinstance(jmsg['text'], str):
+        LOGGER.warning("skipping: text is not a string")
+        socket.send_multipart([address, b'',
+                               json.dumps({
+                                   "result": None,
+                                   "error": "text must be a string"
+                               }).encode('utf-8')])
+        return None
+
+    return address, [jmsg['text']], False
+
+def collectBatch(work, socket, batch, args):
+    """
+    wait up to 'batchwindow' milliseconds for more requests from the work-queue and add
+    them to the batch until 'maxbatchsize' sentences or 'maxbatchtokens' tokens are reached
+    """
+    sentences = sum([len(texts) for address, texts, multi in batch])
+    tokens = sum([countTokens(text) for address, texts, multi in batch for text in texts])
+    deadline = time.time() + args.batchwindow / 1000
+
+    while sentences < args.maxbatchsize and tokens < args.maxbatchtokens:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            break
+        try:
+            frames = work.get(timeout=timeout)
+        except queue.Empty:
+            break
+
+        if len(frames) == 3:
+            request = decodeRequest(socket, frames)
+            if isinstance(request, type(None)):
+                continue
+            batch.append(request)
+            sentences = sentences + len(request[1])
+            tokens = tokens + sum([countTokens(text) for text in request[1]])
+        else:
+            LOGGER.error("Invalid message: %s",str(frames))
+
+    LOGGER.debug("collected batch of %d requests, %d sentences with %d tokens", len(batch), sentences, tokens)
+    return batch
+
+def answerBatch(socket, model, batch, args):
+    """
+    run the model once over all texts of all requests in the batch and send the
+    results back to the address of their request. if the batch fails, its requests are
+    run one by one - only the request that fails gets the error
+    """
+    LOGGER.info("starting prediction on device: %s ", args.device)
+    texts = [text for address, texts, multi in batch for text in texts]
+    BATCH_TEXTS.observe(len(texts))
+    BATCH_REQUESTS.observe(len(batch))
+    start = time.time()
+    try:
+        results = doModel(model, texts, args)
+    except Exception as excep:
+        LOGGER.warning("predition failed: %s",str(excep))
+        # e.g. after an out-of-memory on a long text
+        if not args.keepcudacache and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        if len(batch) > 1:
+            LOGGER.warning("running the %d requests of the failed batch one by one", len(batch))
+            for request in batch:
+                answerBatch(socket, model, [request], args)
+            return
+        INFERENCE_ERRORS.inc()
+        for address, texts, multi in batch:
+            socket.send_multipart([address, b'',
+                                   json.dumps({
+                                       "results" if multi else "result": None,
+                                       "error": "prediction failed: %s" %(str(excep))
+                                   }).encode('utf-8')])
+        return
+    INFERENCE_SECONDS.observe(time.time() - start)
+
+    # all good - send the results
+    offset = 0
+    for address, texts, multi in batch:
+        if multi:
+            reply = { "results": results[offset:offset + len(texts)], "error": None }
+        else:
+            reply = { "result": results[offset], "error": None }
+        offset = offset + len(texts)
+        socket.send_multipart([address, b'', json.dumps(reply).encode('utf-8')])
+
+
 
+def workerInfo(args):
+    """
+    send with READY and HEARTBEAT to the broker. the broker keeps up to 'credit' requests
+    per compute-thread in flight at this worker - needed to get batches at all. the
+    prefetched requests wait in the work-queue until a compute-thread is free.
+    requests with a text longer then 'maxlength' are only send if no other worker is free
+    """
+    return json.dumps({
+        "credit": args.credit * args.computethreads + args.prefetch,
+        "maxlength": args.maxlength
+    }).encode('utf-8')
 
 def setupSocket(args, poller, prefix=None):
     socket = None
@@ -100,7 +424,7 @@ def setupSocket(args, poller, prefix=None):
 
         socket.connect(args.zmqsocket)
         LOGGER.info("announcing myself to Broker as: %s" %(identity.decode()))
-        socket.send(PPP_READY)
+        socket.send_multipart([PPP_READY, workerInfo(args)])
 
     except Exception as excep:
         LOGGER.critical("Could not connect to zmq-broker:%s",str(excep))
@@ -109,26 +433,117 @@ def setupSocket(args, poller, prefix=None):
     finally:
         return socket
 
-def main(args):
-    model, device = setupModel(args)
+def startWorker(ctx, model, device, args, idx):
+    """
+    fork a child that serves the (shared) model as its own worker
+    """
+    process = ctx.Process(target=forkedWorker, args=(model, device, args, idx), daemon=True)
+    process.start()
+    LOGGER.info("started worker-process %d with pid %d", idx, process.pid)
+    return process
+
+def forkedWorker(model, device, args, idx):
+    # every process gets its share of the cpu-threads
+    threads = args.threads if args.threads > 0 else os.cpu_count()
+    torch.set_num_threads(max(1, threads // args.processes))
+    LOGGER.info("worker-process %d uses %d threads", idx, torch.get_num_threads())
+    # every process serves its own metrics
+    if args.metricsport > 0:
+        args.metricsport = args.metricsport + idx
+    serve(model, args, prefix="%s-p%d" % (str(device), idx))
+
+def runProcesses(model, device, args):
+    """
+    fork 'processes' workers that share the weights of the already loaded model.
+    a worker that dies is started again
+    """
+    assert device.type == "cpu", "multiple processes are only supported on the cpu"
+
+    # move the weights to shared memory so the children don't copy them
+    try:
+        model.share_memory()
+    except Exception as excep:
+        LOGGER.warning("could not move the model to shared memory - relying on copy-on-write: %s", str(excep))
+
+    ctx = multiprocessing.get_context("fork")
+    processes = {}
+    for idx in range(args.processes):
+        processes[idx] = startWorker(ctx, model, device, args, idx)
+
+    # systemd stops us via SIGTERM - take the workers with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in processes.values()])
+            for idx, process in processes.items():
+                if not process.is_alive():
+                    LOGGER.warning("worker-process %d died with exitcode %s - restarting", idx, str(process.exitcode))
+                    time.sleep(INTERVAL_INIT)
+                    processes[idx] = startWorker(ctx, model, device, args, idx)
+    finally:
+        for process in processes.values():
+            process.terminate()
+
+def computeThread(context, work, model, args):
+    """
+    runs the model on the requests the io-thread passes on and hands the replies
+    back to it. the io-thread keeps heartbeating in the meantime
+    """
+    results = context.socket(zmq.PUSH)
+    results.connect(RESULT_ENDPOINT)
+
+    while True:
+        try:
+            request = decodeRequest(results, work.get())
+            if isinstance(request, type(None)):
+                continue
+
+            batch = [request]
+            if args.batchwindow > 0:
+                batch = collectBatch(work, results, batch, args)
+
+            answerBatch(results, model, batch, args)
+        except Exception as excep:
+            # the thread must not die - the io-thread keeps heartbeating for it
+            LOGGER.exception("could not handle request: %s", str(excep))
+
+def serve(model, args, prefix):
+    if args.metricsport > 0:
+        startMetricsServer(METRICS, args.metricshost, args.metricsport)
+
+    # warm up before joining the queue of the broker
+    start = time.time()
+    if args.warmuprounds > 0:
+        warmupModel(model, args)
+    start = startupPhase("warm-up", start)
+
+    # the io-thread (this one) owns the socket to the broker. requests are passed on to
+    # the compute-threads and their replies are collected via inproc-sockets
+    context = zmq.Context()
+    work = queue.Queue()
+    results = context.socket(zmq.PULL)
+    results.bind(RESULT_ENDPOINT)
+    computethreads = [threading.Thread(target=computeThread, args=(context, work, model, args), daemon=True)
+                      for idx in range(args.computethreads)]
+    for thread in computethreads:
+        thread.start()
 
     poller = zmq.Poller()
+    poller.register(results, zmq.POLLIN)
 
-    socket = setupSocket(args, poller, prefix=str(device))
+    socket = setupSocket(args, poller, prefix=prefix)
     
-    assert not isinstance(model, type(None)), "Model could not be loaded"
     assert not isinstance(socket, type(None)), "ZeroMQ Socket coult not be created"
+    startupPhase("connect", start)
+    reportStartup()
 
 
-    liveness = args.heartbeatliveness
     interval = INTERVAL_INIT
     
     heartbeat_at = time.time() + args.heartbeatinterval
+    broker_expiry = time.time() + args.heartbeatinterval * args.heartbeatliveness
 
     while True:
-        result = None
-        jmsg = None
-
         # waiting for a message
         socks = dict(poller.poll(args.heartbeatinterval * 1000))
 
@@ -142,88 +557,68 @@ def main(args):
                 break # Interrupted
 
             if len(frames) == 1 and frames[0] == PPP_HEARTBEAT:
-                liveness = args.heartbeatliveness
+                pass
 
-            # regular work request from a client
+            # regular work request from a client - pass it on to the compute-threads
             elif len(frames) == 3:
-                address, empty, request = frames
-
-                liveness = args.heartbeatliveness
-
-                try:
-                    jmsg = json.loads(request.decode("utf-8"))
-                except Exception as excep:
-                    LOGGER.warning("could not decode json message from socket: %s",str(excep))
-                    socket.send_multipart([address, b'',
-                                           json.dumps({
-                                               "result": None,
-                                               "error": "could not decode json message from socket"
-                                           }).encode('utf-8')])
-                    continue
-
-                if 'text' not in jmsg:
-                    LOGGER.warning("skipping: no text in message")
-                    socket.send_multipart([address, b'',
-                                           json.dumps({
-                                               "result": None,
-                                               "error": "no text in message"
-                                           }).encode('utf-8')])
-            
-                    continue
-
-                LOGGER.info("starting prediction on device: %s ", args.device)
-                try:
-
-                    result = doModel(model, jmsg['text'], args)
-            
-                except Exception as excep:
-                    LOGGER.warning("predition failed: %s",str(excep))
-                    socket.send_multipart([address, b'',
-                                           json.dumps({
-                                               "result": None,
-                                               "error": "prediction failed: %s" %(str(execp))
-                                           }).encode('utf-8')])
-                    continue
-
-                # all good - send the result
-                socket.send_multipart([address, b'',
-                                       json.dumps({
-                                           "result": result,
-                                           "error": None
-                                       }).encode('utf-8')])
+                work.put(frames)
 
             else:
                 LOGGER.error("Invalid message: %s",str(frames))
                 
+            broker_expiry = time.time() + args.heartbeatinterval * args.heartbeatliveness
             interval = INTERVAL_INIT
-            
-        else:
-            liveness -= 1
-            if liveness == 0:
-                LOGGER.warning("Heartbeat failure, can't reach queue")
-                LOGGER.warning("Reconnecting in %0.2fs...", interval)
-                time.sleep(interval)
-
-                if interval < INTERVAL_MAX:
-                    interval *= 2
-                poller.unregister(socket)
-                socket.setsockopt(zmq.LINGER, 0)
-                socket.close()
-                socket = setupSocket(args,poller,device)
-                liveness = args.heartbeatliveness
+
+        # a compute-thread is done
+        if socks.get(results) == zmq.POLLIN:
+            socket.send_multipart(results.recv_multipart())
+
+        if time.time() > broker_expiry:
+            LOGGER.warning("Heartbeat failure, can't reach queue")
+            LOGGER.warning("Reconnecting in %0.2fs...", interval)
+            time.sleep(interval)
+
+            if interval < INTERVAL_MAX:
+                interval *= 2
+            poller.unregister(socket)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.close()
+            socket = setupSocket(args,poller,prefix)
+            broker_expiry = time.time() + args.heartbeatinterval * args.heartbeatliveness
         if time.time() > heartbeat_at:
+            # a worker without its compute-threads would only swallow requests - stop
+            # heartbeating, so the broker expires it, and get restarted
+            if not all([thread.is_alive() for thread in computethreads]):
+                LOGGER.critical("a compute-thread died - exiting")
+                sys.exit(1)
             heartbeat_at = time.time() + args.heartbeatinterval
             LOGGER.info("sending Worker heartbeat")
-            socket.send(PPP_HEARTBEAT)
+            socket.send_multipart([PPP_HEARTBEAT, workerInfo(args)])
 
         
 
+def main(args):
+    model, device = setupModel(args)
+    assert not isinstance(model, type(None)), "Model could not be loaded"
+
+    if args.benchmark:
+        benchmark(model, args)
+        return
+
+    if args.processes > 1:
+        runProcesses(model, device, args)
+    else:
+        serve(model, args, prefix=str(device))
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         formatter_class = RawTextDefaultsHelpFormatter,
         description="""
 provides a model prediction via zmq. it accepts json in the form: { "text" "<text>" }
 it returns a json-string with the result of the model-prediction: { "result": <data|null>, "error": <msg|null> }
+several sentences can be send at once as { "texts": ["<text>", ...] }, the reply is then
+{ "results": [<data>, ...]|null, "error": <msg|null> } in the same order.
 the program connects to a zmq-'broker'/proxy on the specific socket. It does not provide
 a socket on its own.
 
@@ -241,6 +636,9 @@ if "error" is not "null" something happend to the model and the "null"-result is
     parser.add_argument('--threads', type = int,
                         default = 0,
                         help = "limit the amount of CPU-threads that can be used; 0 is equivalent to the number of CPUs in the system")
+    parser.add_argument('--processes', type = int,
+                        default = 1,
+                        help = "load the model once and fork this amount of worker-processes that share the weights. every process registers as its own worker at the broker and gets its share of '--threads'. only on cpu")
     parser.add_argument('--device', type = str,
                         choices=['auto','cpu','cuda','cuda:0','cuda:1'], 
                         default = "auto",
@@ -248,11 +646,59 @@ if "error" is not "null" something happend to the model and the "null"-result is
 
     parser.add_argument('--model', type = str,
                         default = "models/ner-english-ontonotes-large.bin",
-                        help = "which model to use - to download other check downloadscript and flairdocumentation")
+                        help = "which model to use - to download other check downloadscript and flairdocumentation. a directory created by the downloadscript with '--fastartifact' is loaded via mmap")
+
+    parser.add_argument('--quantize', type = str,
+                        choices=['none','dynamic-int8'],
+                        default = "none",
+                        help = "apply dynamic int8 quantization to the Linear/LSTM-layers of the model after loading. only on cpu. fast-start artifacts that are already quantized are loaded as they are")
 
     parser.add_argument('--keepcudacache', action="store_true",
                         help = "keep the cachedata on the cuda-device. default is to drop the cache after prediction to free no longer used memory on the device")
 
+    parser.add_argument('--batchwindow', type = float,
+                        default = 0,
+                        help = "collect requests that arrive within this amount of milliseconds after the first one and run the model once over all of them. 0 disables batching")
+    parser.add_argument('--maxbatchsize', type = int,
+                        default = 32,
+                        help = "stop collecting requests for a batch once this amount of sentences is reached")
+    parser.add_argument('--maxbatchtokens', type = int,
+                        default = 2048,
+                        help = "stop collecting requests for a batch once the (whitespace-split) tokens of all requests reach this amount")
+    parser.add_argument('--minibatchsize', type = int,
+                        default = 32,
+                        help = "the mini_batch_size passed to the model-prediction. a batch with more sentences is split into several minibatches")
+    parser.add_argument('--credit', type = int,
+                        default = 1,
+                        help = "how many requests per compute-thread the broker may send to this worker before it replied. with batching use about 'maxbatchsize' requests, otherwise the worker never gets more then one request at once")
+    parser.add_argument('--maxlength', type = int,
+                        default = 0,
+                        help = "tell the broker to send requests with a text longer then this amount of characters only if no other worker is free. use it on cpu-workers to keep the long texts for the gpu-workers. 0 accepts any length")
+    parser.add_argument('--prefetch', type = int,
+                        default = 1,
+                        help = "ask the broker for this amount of requests in addition to 'credit', so the next request is already waiting when the model is done")
+    parser.add_argument('--computethreads', type = int,
+                        default = 1,
+                        help = "the amount of threads that run the model. the socket to the broker and the heartbeats are handled by a thread of its own")
+    parser.add_argument('--nobucketing', action="store_true",
+                        help = "pass the sentences of a batch to the model as they are instead of sorting them by their length and splitting them into minibatches here. flair sorts them by itself, the minibatches are just not logged")
+    parser.add_argument('--warmuprounds', type = int,
+                        default = 2,
+                        help = "run synthetic sentences this often through the model before announcing the worker at the broker. 0 disables the warm-up")
+    parser.add_argument('--warmuplengths', type = int, nargs='+',
+                        default = [5,20,80],
+                        help = "the length (in tokens) of the synthetic sentences used for the warm-up")
+    parser.add_argument('--benchmark', type = str,
+                        default = None,
+                        help = "don't connect to a broker. read sentences (one per line) from this file, run them in batches of 'maxbatchsize' through plain model.predict and with bucketing and report the real and padded tokens per minibatch")
+
+    parser.add_argument('--metricsport', type = int,
+                        default = 0,
+                        help = "serve prometheus-metrics via http on this port (path /metrics). with '--processes' every process uses the next port. 0 disables the metrics")
+    parser.add_argument('--metricshost', type = str,
+                        default = "127.0.0.1",
+                        help = "the address the metrics are served on. Use 0.0.0.0 for every ip")
+
     parser.add_argument('--zmqsocket', type = str,
                         default = "tcp://localhost:5560",
                         help = "where to find the zmq-proxy/broker to register as worker")
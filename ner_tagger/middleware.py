@@ -122,6 +122,18 @@ def zmqmiddleware(data,args):
     # act as it would be a passthrough
     return data
 
+# the middlewares that never read the tokens of the model-result
+TOKENLESS = ['sentiment', 'nertagger', 'zmq']
+
+def projectresult(data):
+    """
+    the model-result without the tokens. text, labels and entities are kept - everything
+    but the passthroughmiddleware reads. the tokens are most of the size of a result
+    """
+    if not isinstance(data,dict):
+        return data
+    return dict([(key, value) for key, value in data.items() if key != 'tokens'])
+
 middleware = {
     'passthrough': passthroughmiddleware,
     'sentiment': sentimentmiddleware,
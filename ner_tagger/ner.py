@@ -5,6 +5,11 @@ import json
 from collections import defaultdict
 
 import uuid
+import time
+import threading
+import os
+import re
+import hashlib
 
 from concurrent.futures import ThreadPoolExecutor
 
@@ -16,10 +21,10 @@ import gunicorn.app.base
 import zmq
 
 # used for data postprocessing
-from .middleware import middleware
+from .middleware import middleware, projectresult, TOKENLESS
 
 # used to split into sentence
-from .sentsplitter import sentsplitter
+from .sentsplitter import sentsplitter, cleanup
 
 # enforce german locale
 locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
@@ -30,14 +35,32 @@ logging.basicConfig(format='%(asctime)s %(name)s' +
         '\t%(levelname)s:\t%(message)s',level=logging.WARN)
 LOGGER = logging.getLogger(__name__)
 
-def textsplitner(sentences,args):
+# counters of this (gunicorn-)worker - served at /api/v1/stats
+STATS = defaultdict(int)
+STATS_LOCK = threading.Lock()
+
+def countstats(**counters):
+    with STATS_LOCK:
+        for key, value in counters.items():
+            STATS[key] = STATS[key] + value
+
+def textsplitner(sentences,args,priority=None):
     result = []
     splitsentences = sentsplitter[args.sentsplitter](sentences,args)
-    # do parallel processing on all sentences
-    argsarray = [args]*len(splitsentences)
+    # identical sentences (bylines, "Foto: dpa", ...) are only processed once. they are
+    # compared by their cleaned text, but the first of them is what the model and the
+    # cache get - as before
+    keys = [cleanup(sentence).strip() for sentence in splitsentences]
+    firstsentences = {}
+    for key, sentence in zip(keys, splitsentences):
+        firstsentences.setdefault(key, sentence)
+    uniquekeys = list(firstsentences)
+    countstats(sentences=len(keys), duplicatesentences=len(keys) - len(uniquekeys))
+    LOGGER.info("%d sentences, %d unique", len(keys), len(uniquekeys))
+    # cache lookups and model requests are done in parallel
     try:
-        with ThreadPoolExecutor(args.maxparallelmodelrequests) as tpool:
-            result = list(tpool.map(ner,splitsentences,argsarray))
+        uniqueresult = dict(zip(uniquekeys, nerbatch([firstsentences[key] for key in uniquekeys],args,priority)))
+        result = [uniqueresult[key] for key in keys]
     except Exception as exep:
         LOGGER.warning("could not process request: %s",str(exep))
             
@@ -48,16 +71,10 @@ def cacherequest(sent,args):
     """
     ask zmq-cache for data
     """
-    cachecontext = zmq.Context()
-    cachesocket = cachecontext.socket(zmq.REQ)
-    cachesocket.connect(args.zmqcachesocket)
-    LOGGER.debug("requesting from cache")
-    cachesocket.send(json.dumps({
+    jmsg = zmqcacherequest({
         "cmd": "retrieve",
         "key": sent
-    }).encode('utf-8'))
-    cachemsg = cachesocket.recv()
-    jmsg = json.loads(cachemsg.decode("utf-8"))
+    }, args)
     if not isinstance(jmsg['result'],type(None)):
         LOGGER.info("cachehit for: %s",sent)
         data = jmsg['result']
@@ -67,26 +84,115 @@ def cacherequest(sent,args):
         LOGGER.info("not a cachehit")
         return None
 
-def cacheit(key,value,args):
+def zmqcacherequest(payload,args):
     """
-    ask zmq-cache for data
+    send one request to the zmq-cache and return the decoded reply. the sockets of all
+    requests share the context of the process
     """
-    cachecontext = zmq.Context()
-    cachesocket = cachecontext.socket(zmq.REQ)
+    if args.cachenamespace:
+        payload = dict(payload, ns=args.cachenamespace)
+    cachesocket = zmq.Context.instance().socket(zmq.REQ)
     cachesocket.connect(args.zmqcachesocket)
     LOGGER.debug("requesting from cache")
-    cachesocket.send(json.dumps({
+    try:
+        cachesocket.send(json.dumps(payload).encode('utf-8'))
+        cachemsg = cachesocket.recv()
+    finally:
+        cachesocket.close(linger=0)
+    return json.loads(cachemsg.decode("utf-8"))
+
+def cachemultirequest(sents,args):
+    """
+    ask zmq-cache for the data of all sentences at once. None is a cachemiss
+    """
+    if len(sents) == 0:
+        return []
+    jmsg = zmqcacherequest({
+        "cmd": "mget",
+        "keys": sents
+    }, args)
+    if isinstance(jmsg['result'],type(None)):
+        LOGGER.warning("CacheServer did not answer mget: %s",str(jmsg['error']))
+        return [None] * len(sents)
+    LOGGER.info("%d of %d sentences in cache", len([data for data in jmsg['result'] if not isinstance(data,type(None))]), len(sents))
+    return jmsg['result']
+
+def cachemultistore(keys,values,args):
+    """
+    store the values of all keys at once
+    """
+    if len(keys) == 0:
+        return
+    jmsg = zmqcacherequest({
+        "cmd": "mset",
+        "keys": keys,
+        "values": [cachevalue(value,args) for value in values]
+    }, args)
+    if jmsg['result'] != "ACK":
+        LOGGER.info("CacheServer did not store: %s",str(jmsg))
+
+def cacheprojection(args):
+    if args.cacheprojection == "entities" or (args.cacheprojection == "auto" and args.middleware in TOKENLESS):
+        return "entities"
+    return "full"
+
+def cachenamespace(args):
+    """
+    the namespace of the cache. either given by '--cachenamespace' or a fingerprint of the
+    modelfile (or the files of a fast-start directory), the modelvariant and what is stored.
+    without any of them the default namespace of the cacheServer is used
+    """
+    if args.cachenamespace:
+        return args.cachenamespace
+    if not args.modelfile:
+        return None
+
+    fingerprint = hashlib.sha1()
+    paths = [args.modelfile]
+    if os.path.isdir(args.modelfile):
+        paths = sorted([os.path.join(args.modelfile, name) for name in os.listdir(args.modelfile)
+                        if os.path.isfile(os.path.join(args.modelfile, name))])
+    start = time.time()
+    for path in paths:
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                fingerprint.update(block)
+    fingerprint.update(json.dumps([args.modelvariant, cacheprojection(args)]).encode('utf-8'))
+    LOGGER.info("fingerprint of %s took %.1fs", args.modelfile, time.time() - start)
+
+    name = re.sub('[^A-Za-z0-9_-]', '_', os.path.basename(os.path.normpath(args.modelfile)))
+    return "%s-%s" % (name[:40], fingerprint.hexdigest()[:16])
+
+def cachevalue(data,args):
+    """
+    what to store in the cache - without the tokens if the middleware does not need them
+    """
+    if cacheprojection(args) == "entities":
+        return projectresult(data)
+    return data
+
+def cacheit(key,value,args):
+    """
+    store data in zmq-cache
+    """
+    jmsg = zmqcacherequest({
         "cmd": "store",
         "key": key,
-        "value": value
-    }).encode('utf-8'))
-    cachemsg = cachesocket.recv()
+        "value": cachevalue(value,args)
+    }, args)
     # at that point we are at fire and forget, either store it or not, i don't care
-    jmsg = json.loads(cachemsg.decode("utf-8"))
     if jmsg['result'] != "ACK":
         LOGGER.info("CacheServer did not store: %s",str(jmsg))
 
-def modelrequest(sent,args):
+def zmqmodelrequest(payload,args,priority=None,length=None):
+    """
+    send a json-payload to the model-broker following the lazy-pirate-pattern.
+    returns the decoded reply or None if all retries died.
+    a priority ('interactive' or 'bulk') and the length of the longest text ('length:<n>') are
+    send as frames of their own in front of the payload.
+    busy-replies of the broker don't use up a retry - the client backs off exponentially
+    until it waited as long as all timeouts together
+    """
     REQUEST_TIMEOUT = args.zmqmodeltimeout # milliseconds in array
     REQUEST_RETRIES = len(args.zmqmodeltimeout)
     context = zmq.Context()
@@ -94,12 +200,23 @@ def modelrequest(sent,args):
     LOGGER.info("Connecting to broker… %s",args.zmqmodelsocket)
     client.connect(args.zmqmodelsocket)
     
-    request = json.dumps({ "text": sent }).encode('utf-8')
+    request = json.dumps(payload).encode('utf-8')
     LOGGER.debug("Sending request: %s", request.decode('utf-8'))
+    message = [request]
+    if not isinstance(length, type(None)):
+        message = [("length:%d" % (length)).encode('utf-8')] + message
+    if priority:
+        message = [priority.encode('utf-8')] + message
                  
-    client.send(request)
-
-    for retry in range(REQUEST_RETRIES):
+    client.send_multipart(message)
+    busy = False
+    # at least a millisecond - otherwise a busy broker would be asked in a tight loop
+    backoff = max(1, args.zmqmodelbusybackoff)
+    start = time.time()
+
+    retry = 0
+    while retry < REQUEST_RETRIES:
+        busy = False
         if (client.poll(REQUEST_TIMEOUT[retry]) & zmq.POLLIN) != 0:
             # all good - server replied within timeout
             # fetch message, decode it, check for error and return it if fine
@@ -108,10 +225,23 @@ def modelrequest(sent,args):
             # there was an error somehow
             if isinstance(jmsg['error'], type(None)):
                 LOGGER.info("got data")
-                return jmsg['result']
+                return jmsg
+            elif jmsg.get('busy', False):
+                busy = True
+                if (time.time() - start) * 1000 >= sum(REQUEST_TIMEOUT):
+                    break
+                # the broker rejected the request right away - no need to wait for the timeout
+                LOGGER.warning("broker is busy - retrying in %d (ms)",backoff)
+                time.sleep(backoff / 1000)
+                backoff = min(backoff * 2, max(REQUEST_TIMEOUT))
+                client.send_multipart(message)
+                continue
             else:
                 LOGGER.warning("try %d/%d server returned with error: %s",retry+1,REQUEST_RETRIES,jmsg['error'])
-                # retry
+                # retry right away - the socket may send again after a reply
+                retry = retry + 1
+                if retry < REQUEST_RETRIES:
+                    client.send_multipart(message)
                 continue
                 
         LOGGER.warning("No response from server within Timeout: %d (ms)", REQUEST_TIMEOUT[retry])
@@ -125,20 +255,65 @@ def modelrequest(sent,args):
         # Create new connection
         client = context.socket(zmq.REQ)
         client.connect(args.zmqmodelsocket)
-        logging.info("Retry: %d with timeout %d (ms) sending (%s)", retry, REQUEST_TIMEOUT[retry], request)
-        client.send(request)
+        retry = retry + 1
+        if retry < REQUEST_RETRIES:
+            logging.info("Retry: %d with timeout %d (ms) sending (%s)", retry, REQUEST_TIMEOUT[retry], request)
+            client.send_multipart(message)
 
     # all retries died
-    LOGGER.error("Server seems to be offline after %d retries and %s timeouts -> abandoning",
-                 REQUEST_RETRIES, str(REQUEST_TIMEOUT))
+    if busy:
+        LOGGER.error("Broker is still busy after %d (ms) -> abandoning", (time.time() - start) * 1000)
+    else:
+        LOGGER.error("Server seems to be offline after %d retries and %s timeouts -> abandoning",
+                     REQUEST_RETRIES, str(REQUEST_TIMEOUT))
     client.setsockopt(zmq.LINGER, 0)
     client.close()
 
-    # act as it would be a passthrough
-    return {}
+    return None
+
+def modelrequest(sent,args,priority=None):
+    """
+    returns None if the request failed
+    """
+    jmsg = zmqmodelrequest({ "text": sent },args,priority,len(sent))
+    if isinstance(jmsg, type(None)):
+        return None
+    return jmsg['result']
+
+def modelbatchrequest(sents,args,priority=None):
+    """
+    send several sentences in one message to the model-broker. returns None if the
+    request failed
+    """
+    # the broker routes by the longest text, not by the size of the whole message
+    jmsg = zmqmodelrequest({ "texts": sents },args,priority,max([len(sent) for sent in sents]))
+    if isinstance(jmsg, type(None)):
+        return None
+    return jmsg['results']
 
+def chunkrequests(sents,args):
+    """
+    group the sentences into messages of at most 'maxtextspermessage' sentences and
+    'maxcharspermessage' characters, so the load is still spread across the model-servers.
+    returns a list of lists of indices into sents
+    """
+    chunks = []
+    chunk = []
+    chars = 0
+    for idx, sent in enumerate(sents):
+        if len(chunk) > 0 and (len(chunk) >= args.maxtextspermessage or
+                               chars + len(sent) > args.maxcharspermessage):
+            chunks.append(chunk)
+            chunk = []
+            chars = 0
+        chunk.append(idx)
+        chars = chars + len(sent)
+    if len(chunk) > 0:
+        chunks.append(chunk)
+
+    return chunks
     
-def ner(sent,args):
+def ner(sent,args,priority=None):
 
     data = defaultdict(set)
 
@@ -147,7 +322,10 @@ def ner(sent,args):
         if not isinstance(data,type(None)):
             return data
     # if we are still here, we ask the zmq-worker
-    data = modelrequest(sent,args)
+    data = modelrequest(sent,args,priority)
+    if isinstance(data, type(None)):
+        # act as it would be a passthrough - but don't cache it
+        return {}
     # store in cache
     if not args.disablecache:
         cacheit(key=sent,value=data, args=args)
@@ -156,9 +334,68 @@ def ner(sent,args):
             
     return data
 
+def nerbatch(sents,args,priority=None):
+    """
+    like ner() but for all sentences of a document. the cache is asked for all
+    sentences at once, the misses are send to the model in as few messages as allowed
+    and their results are stored in the cache at once
+    """
+    result = [None] * len(sents)
+    if not args.disablecache:
+        result = cachemultirequest(sents,args)
+
+    misses = [idx for idx, data in enumerate(result) if isinstance(data,type(None))]
+    chunks = chunkrequests([sents[idx] for idx in misses],args)
+    # chunkrequests indexes into the misses - translate back to sents
+    chunks = [[misses[idx] for idx in chunk] for chunk in chunks]
+    LOGGER.info("%d of %d sentences not cached - sending %d messages to the model",
+                len(misses), len(sents), len(chunks))
+
+    with ThreadPoolExecutor(args.maxparallelmodelrequests) as tpool:
+        replies = list(tpool.map(modelbatchrequest,
+                                 [[sents[idx] for idx in chunk] for chunk in chunks],
+                                 [args]*len(chunks),
+                                 [priority]*len(chunks)))
+
+    # the sentences of failed messages are answered as passthrough but not cached
+    failed = set()
+    for chunk, reply in zip(chunks, replies):
+        if isinstance(reply, type(None)):
+            failed.update(chunk)
+            reply = [{}] * len(chunk)
+        elif len(reply) != len(chunk):
+            LOGGER.error("model returned %d results for %d sentences - treating the message as failed",
+                         len(reply), len(chunk))
+            failed.update(chunk)
+            reply = [{}] * len(chunk)
+        for idx, data in zip(chunk, reply):
+            result[idx] = data
+    # store in cache
+    if not args.disablecache:
+        stored = [idx for idx in misses if idx not in failed]
+        cachemultistore([sents[idx] for idx in stored],[result[idx] for idx in stored],args)
+
+    LOGGER.debug("modeldata: %s",str(result))
+
+    return result
+
 def create_app(description, args):
 
     nerapi = Flask(__name__)
+
+    if not args.disablecache:
+        args.cachenamespace = cachenamespace(args)
+        LOGGER.info("using cache-namespace: %s", str(args.cachenamespace))
+
+    def requestpriority():
+        """
+        the priority of the model-requests: the header 'X-Priority' or the default
+        """
+        priority = request.headers.get('X-Priority', args.defaultpriority)
+        if priority not in ['interactive', 'bulk']:
+            LOGGER.warning("unknown priority %s - using %s", priority, args.defaultpriority)
+            priority = args.defaultpriority
+        return priority
     
     @nerapi.route('/')
     def index():
@@ -168,7 +405,7 @@ def create_app(description, args):
     def api_ner():
 
         text = request.get_json().get('text')
-        data = textsplitner(text,args)
+        data = textsplitner(text,args,requestpriority())
     
         # do postprocessing 
         data = middleware[args.middleware](data,args)
@@ -193,23 +430,24 @@ def create_app(description, args):
                     parts.append(str(sentence))
 
             # run model on every part
-            result = []
-            for part in parts:
-                data = ner(part,args)
-                # merge the results
-                result.append(data)
+            result = nerbatch(parts,args,requestpriority())
 
             # do postprocessing 
             result = middleware[args.middleware](result,args)
 
             return json.dumps(result)
         else:
-            result = ner(text,args)
+            result = ner(text,args,requestpriority())
             # do postprocessing 
             result = middleware[args.middleware](result,args)
             
             return json.dumps(result)
 
+    @nerapi.route('/api/v1/stats',methods=['GET'])
+    def api_stats():
+        with STATS_LOCK:
+            return json.dumps(STATS)
+
     @nerapi.route('/api/v1/split',methods=['POST'])
     def api_split():
         text = request.get_json().get('text')
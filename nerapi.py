@@ -42,15 +42,37 @@ the '/api/nernosplit' endpoint will try to process the text without splitting at
     parser.add_argument('--zmqcachesocket', type = str,
                         default = "ipc:///tmp/cache.ipc",
                         help = "the socket of the cacheserver")
+    parser.add_argument('--cachenamespace', type = str,
+                        default = None,
+                        help = "the namespace of the cache for the results of this model. if None is given it is a fingerprint of 'modelfile' and 'modelvariant'. without both the default namespace of the cacheServer is used")
+    parser.add_argument('--modelfile', type = str,
+                        default = None,
+                        help = "the model(-directory) the modelServers use - only read to compute the namespace of the cache, so results of different models are never mixed up")
+    parser.add_argument('--modelvariant', type = str,
+                        default = "",
+                        help = "anything else that changes the results of the model and is part of the namespace of the cache - e.g. 'dynamic-int8' if the modelServers quantize the model")
     parser.add_argument('--zmqmodelsocket', type = str,
                         default = "tcp://127.0.0.1:5559",
                         help = "the socket of the model-server or broker")
     parser.add_argument('--zmqmodeltimeout', type = int, nargs='+',
                         default = [2000,5000,10000],
                         help = "the timeouts for the model-server in milliseconds before every retry - more timeouts, means more retries")
+    parser.add_argument('--zmqmodelbusybackoff', type = int,
+                        default = 200,
+                        help = "if the broker replies that it is busy, wait this amount of milliseconds before the next retry - doubled on every further busy-reply, at least 1. busy-replies do not use up the retries of 'zmqmodeltimeout'")
+    parser.add_argument('--defaultpriority', type = str,
+                        choices=['interactive','bulk'],
+                        default = 'interactive',
+                        help = "the priority of the requests to the model-broker, unless the http-request sets the header 'X-Priority: <interactive|bulk>'. the broker serves interactive requests first")
     parser.add_argument('--maxparallelmodelrequests', type = int,
                         default = 4,
                         help = "after splitting the text into sentences, they are send to the modelserver. defines how many parallel-requests are made. if there is more then one modelserver it is resonable to use all in parallel.")
+    parser.add_argument('--maxtextspermessage', type = int,
+                        default = 8,
+                        help = "the sentences of a text that are not cached are send to the modelserver in messages of at most this amount of sentences. smaller messages spread the load over more modelservers")
+    parser.add_argument('--maxcharspermessage', type = int,
+                        default = 4000,
+                        help = "limit the characters of all sentences in one message to the modelserver. a single sentence that is longer is still send on its own")
     parser.add_argument('--zmqsplitsocket', type = str,
                         default = "tcp://127.0.0.1:5561",
                         help = "the socket to the frontend of the 'split-zmqbroker'.")
@@ -72,6 +94,10 @@ the '/api/nernosplit' endpoint will try to process the text without splitting at
                         help = "the maximum length of the text when using the nosplit endpoint. if the size is exceded the split (default) endpoint will be used. large text will lead high vRAM usage and workers may not like that.Also the model may not beeing trained on long context.")
     parser.add_argument('--disablecache', action='store_true',
                         help = "disable the usage of a cache")
+    parser.add_argument('--cacheprojection', type = str,
+                        choices=['auto','full','entities'],
+                        default = 'auto',
+                        help = "what to store in the cache. full: the whole model-result. entities: text, labels and entities without the tokens - a fraction of the size, but the passthrough-middleware does not return the tokens on a cachehit. auto: entities unless the passthrough-middleware is used")
     parser.add_argument('--middleware', type = str,
                         default = 'nertagger',
                         choices=list(middleware.keys()),
@@ -11,7 +11,7 @@ setup(
         packages=find_packages(),
         data_files=[
             ('models',['models/ner-english-ontonotes-large.bin']),
-            ('.',['download_and_convert_model_for_local_use.py','nerapi.py','ner-clean-cache.sh','modelServer.py','cacheServer.py','zmqBroker.py']),
+            ('.',['download_and_convert_model_for_local_use.py','nerapi.py','modelServer.py','cacheServer.py','cacheTool.py','zmqBroker.py','evaluateQuantization.py','metrics.py']),
             ('nltk_data/tokenizers/punkt/PY3',['nltk_data/tokenizers/punkt/PY3/german.pickle','nltk_data/tokenizers/punkt/PY3/english.pickle']),
             ('nltk_data/tokenizers/punkt',['nltk_data/tokenizers/punkt/english.pickle','nltk_data/tokenizers/punkt/german.pickle'])
         ],
@@ -2,9 +2,11 @@
 
 import logging
 import argparse
+import json
 
 from dataclasses import dataclass
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, deque
+import hashlib
 
 import time
 
@@ -12,7 +14,9 @@ import zmq
 
 from zmq.eventloop.zmqstream import ZMQStream
 
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from metrics import Registry, startMetricsServer
 
 # configure logging and LOGGER
 logging.basicConfig(format='%(asctime)s %(name)s' +
@@ -25,6 +29,18 @@ LOGGER = logging.getLogger(__name__)
 PPP_READY = b"\x01"      # Signals worker is ready
 PPP_HEARTBEAT = b"\x02"  # Signals worker heartbeat
 
+# send to clients if 'maxpending' requests of their priority are already waiting for a worker
+BUSY_REPLY = json.dumps({ "result": None, "error": "busy", "busy": True }).encode('utf-8')
+# clients may send a priority-frame in front of the payload - the first lane is served first
+PRIORITIES = [b"interactive", b"bulk"]
+# clients may send the length (characters) of the longest text of the payload as a frame 'length:<n>'
+LENGTH_HEADER = b"length:"
+
+# send to clients if every worker that got the request died
+DEAD_REPLY = json.dumps({ "result": None, "error": "worker died while processing the request" }).encode('utf-8')
+# send to clients that waited for the reply to an identical request the worker held longer then '--requesttimeout'
+ABANDONED_REPLY = json.dumps({ "result": None, "error": "worker did not answer in time" }).encode('utf-8')
+
 
 # argparse magic
 class RawTextDefaultsHelpFormatter(argparse.RawDescriptionHelpFormatter,
@@ -38,129 +54,494 @@ class Worker:
     address: str
     heartbeatinterval: float = 2.0  # every two seconds as default
     heartbeatsliveness: int = 3 # try three times
+    credit: int = 1 # amount of requests the worker wants to hold at once
+    maxlength: int = 0 # texts up to this length (characters) are handled efficiently - 0 is any length
     
     def __post_init__(self):
         self.expiry = time.time() + self.heartbeatinterval * self.heartbeatsliveness
-        
+        self.inflight = 0
+        self.inflightbytes = 0
+        # ewma of the seconds the worker spends per request and per byte of the request -
+        # without the time a request waited at the worker
+        self.servicetime = 0.0
+        self.bytetime = 0.0
+        self.lastdone = 0.0
+
+    def refresh(self):
+        self.expiry = time.time() + self.heartbeatinterval * self.heartbeatsliveness
 
+    def prefers(self, length):
+        return self.maxlength == 0 or length <= self.maxlength
         
-        
+
+@dataclass(eq=False)
+class Request:
+    """Class for keeping track of a client request."""
+    frames: list # the envelope of the client and the payload
+    priority: int = 0 # index into PRIORITIES
+    redispatches: int = 0
+    length: int = None # of the longest text - the size of the payload if the client did not send it
+
+    def __post_init__(self):
+        self.envelope = tuple(self.frames[:-1])
+        self.size = len(self.frames[-1])
+        if isinstance(self.length, type(None)):
+            self.length = self.size
+        self.received = time.time()
+        # the newest client that asked for the payload - the request is dropped once that one gave up
+        self.latest = self.received
+        self.dispatched = None
+        self.key = hashlib.sha1(self.frames[-1]).digest()
+        # envelopes of clients that asked for the same payload meanwhile
+        self.waiters = []
+
+
+def workerInfo(frames):
+    """
+    workers may send a json-frame with their READY or HEARTBEAT like
+    '{"credit": 4, "maxlength": 0}'
+    """
+    info = { "credit": 1, "maxlength": 0 }
+    if len(frames) > 1:
+        try:
+            jmsg = json.loads(frames[1].decode('utf-8'))
+            info['credit'] = max(1, int(jmsg.get('credit', 1)))
+            info['maxlength'] = max(0, int(jmsg.get('maxlength', 0)))
+        except Exception as excep:
+            LOGGER.warning("could not decode workerinfo %s: %s", str(frames[1]), str(excep))
+    return info
+
+
+def requestHeaders(frames):
+    """
+    clients may send header-frames in front of the payload: the priority ('interactive' or
+    'bulk') and the length of the longest text ('length:<n>'). the workers don't get them.
+    returns the frames without the headers, the priority and the length (None if not send)
+    """
+    priority = 0
+    length = None
+    # [client, b'', headers.., payload]
+    while len(frames) > 3:
+        if frames[-2] in PRIORITIES:
+            priority = PRIORITIES.index(frames[-2])
+        elif frames[-2].startswith(LENGTH_HEADER):
+            try:
+                length = max(0, int(frames[-2][len(LENGTH_HEADER):]))
+            except ValueError:
+                LOGGER.warning("invalid length-header: %s", str(frames[-2]))
+        else:
+            break
+        frames = frames[:-2] + frames[-1:]
+    return frames, priority, length
+
+
+def identity(address):
+    """a printable name of a zmq-identity - generated identities are binary"""
+    name = address.decode('utf-8', 'backslashreplace')
+    return name if name.isprintable() else address.hex()
+
+
+class PendingQueue(object):
+    """requests that wait for a worker - one lane per priority"""
+
+    def __init__(self, weights=None):
+        self.lanes = [deque() for priority in PRIORITIES]
+        # None: a lane is only served if all lanes with a higher priority are empty.
+        # otherwise every lane gets its weight of requests per round
+        self.weights = [max(1, weight) for weight in weights] if weights else None
+        self.credits = list(self.weights) if weights else None
+
+    def __len__(self):
+        return sum([len(lane) for lane in self.lanes])
+
+    def append(self, request):
+        self.lanes[request.priority].append(request)
+
+    def appendleft(self, request):
+        self.lanes[request.priority].appendleft(request)
+
+    def promote(self, request, priority):
+        """move a waiting request to the lane of a higher priority"""
+        self.lanes[request.priority].remove(request)
+        request.priority = priority
+        self.lanes[priority].append(request)
+
+    def expire(self, oldest):
+        """remove the requests of which every client asked before 'oldest' and gave up meanwhile"""
+        expired = []
+        for idx, lane in enumerate(self.lanes):
+            if any([request.latest < oldest for request in lane]):
+                expired.extend([request for request in lane if request.latest < oldest])
+                self.lanes[idx] = deque([request for request in lane if request.latest >= oldest])
+        return expired
+
+    def popleft(self):
+        if isinstance(self.weights, type(None)):
+            for lane in self.lanes:
+                if len(lane) > 0:
+                    return lane.popleft()
+            raise IndexError("pop from an empty PendingQueue")
+
+        for refill in [False, True]:
+            if refill:
+                self.credits = list(self.weights)
+            for idx, lane in enumerate(self.lanes):
+                if len(lane) > 0 and self.credits[idx] > 0:
+                    self.credits[idx] = self.credits[idx] - 1
+                    return lane.popleft()
+        raise IndexError("pop from an empty PendingQueue")
 
 
 class LRUQueue(object):
     """LRUQueue class for event dispatching an loadbalancing"""
 
-    def __init__(self):
+    def __init__(self, heartbeatinterval=2.0, heartbeatsliveness=3, policy="lru", ewmaalpha=0.3):
         self.queue =  OrderedDict()
+        self.heartbeatinterval = heartbeatinterval
+        self.heartbeatsliveness = heartbeatsliveness
+        self.policy = policy
+        self.ewmaalpha = ewmaalpha
+
+    def worker(self, address, info=None):
+        worker = Worker(address, self.heartbeatinterval, self.heartbeatsliveness)
+        if not isinstance(info, type(None)):
+            worker.credit = info['credit']
+            worker.maxlength = info['maxlength']
+        return worker
 
     def ready(self, worker):
         self.queue.pop(worker.address, None)
         self.queue[worker.address] = worker
 
+    def refresh(self, address, info):
+        """a heartbeat from a worker - keep its requests in flight"""
+        worker = self.queue.get(address, None)
+        if isinstance(worker, type(None)):
+            self.ready(self.worker(address, info))
+        else:
+            worker.credit = info['credit']
+            worker.maxlength = info['maxlength']
+            worker.refresh()
+
+    def done(self, address, request):
+        """a worker replied to a request it holds - it has one request less in flight. learn how long it took"""
+        worker = self.queue.pop(address, None)
+        if isinstance(worker, type(None)):
+            # the requests of a worker are taken from it when it expires - nothing to learn
+            return
+        worker.inflight = max(0, worker.inflight - 1)
+        worker.refresh()
+        worker.inflightbytes = max(0, worker.inflightbytes - request.size)
+        # the worker was busy with this request since its dispatch - or since the reply
+        # before, if that one came later. the time it waited behind others doesn't count
+        now = time.time()
+        sample = now - max(request.dispatched, worker.lastdone)
+        worker.lastdone = now
+        if worker.servicetime == 0.0:
+            worker.servicetime = sample
+            worker.bytetime = sample / max(request.size, 1)
+        else:
+            worker.servicetime = (1 - self.ewmaalpha) * worker.servicetime + self.ewmaalpha * sample
+            worker.bytetime = (1 - self.ewmaalpha) * worker.bytetime + self.ewmaalpha * sample / max(request.size, 1)
+        self.queue[address] = worker
+
+    def available(self):
+        """is there any worker that can take another request"""
+        for worker in self.queue.values():
+            if worker.inflight < worker.credit:
+                return True
+        return False
         
     def purge(self):
-        """Look for & kill expired workers."""
+        """Look for & kill expired workers. returns their addresses"""
         t = time.time()
         expired = []
         for address, worker in self.queue.items():
             if t > worker.expiry:  # Worker expired
                 expired.append(address)
         for address in expired:
-            self.queue.pop(address, None)        
+            self.queue.pop(address, None)
         if len(expired) > 0:
             LOGGER.info("Idle worker(s) expired: %s",str(expired))
             LOGGER.info("%d Remaining aktiv Workers: %s",len(self.queue), str(list(self.queue)))
-
-    def next(self):
-        address, worker = self.queue.popitem(False)
-        return address
+        return expired
+
+    def cost(self, worker, size):
+        """
+        lru: the least loaded worker.
+        ewma: the expected time until the worker is done with its requests and this one.
+        ewma-size: the same but measured by the size of the requests.
+        the measured time between replies already reflects how many requests a worker
+        processes at once. workers that were never measured cost nothing, so every worker
+        gets measured
+        """
+        if self.policy == "ewma":
+            return (worker.inflight + 1) * worker.servicetime
+        elif self.policy == "ewma-size":
+            return (worker.inflightbytes + size) * worker.bytetime
+        return worker.inflight / worker.credit
+
+    def next(self, size=0, length=0):
+        """
+        the cheapest worker by policy - the least recently used one if several are equal.
+        only workers that handle the longest text of the request efficiently are
+        considered - as long as one of them is free
+        """
+        candidates = [worker for worker in self.queue.values() if worker.inflight < worker.credit]
+        preferred = [worker for worker in candidates if worker.prefers(length)]
+        if len(preferred) > 0:
+            candidates = preferred
+        else:
+            LOGGER.debug("no preferred worker free for a text of %d characters", length)
+        worker = min(candidates, key=lambda worker: self.cost(worker, size))
+        worker.inflight = worker.inflight + 1
+        worker.inflightbytes = worker.inflightbytes + size
+        self.queue.move_to_end(worker.address)
+        return worker.address
 
 
     
 
-def main(args):
-    """ main method """
-
-    context = zmq.Context()
+class Broker(object):
+    """event driven broker between the clients on the frontend and the workers on the backend"""
 
-    # Socket facing clients
-    frontend = context.socket(zmq.ROUTER)
-    frontend.bind(args.frontendsocket)
-    LOGGER.info("Frontend open on: %s",args.frontendsocket)
+    def __init__(self, args):
+        self.args = args
+        context = zmq.Context()
 
-    # Socket facing services
-    backend  = context.socket(zmq.ROUTER)
-    backend.bind(args.backendsocket)
-    LOGGER.info("Backend open on: %s",args.backendsocket)
+        # Socket facing clients
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind(args.frontendsocket)
+        LOGGER.info("Frontend open on: %s",args.frontendsocket)
 
-    LOGGER.info("Connecting Frontend and Backend.")
+        # Socket facing services
+        backend  = context.socket(zmq.ROUTER)
+        backend.bind(args.backendsocket)
+        LOGGER.info("Backend open on: %s",args.backendsocket)
 
-    poll_workers = zmq.Poller()
-    poll_workers.register(backend, zmq.POLLIN)
+        self.frontend = ZMQStream(frontend)
+        self.frontend.on_recv(self.handleFrontend)
+        self.backend = ZMQStream(backend)
+        self.backend.on_recv(self.handleBackend)
 
-    poll_both = zmq.Poller()
-    poll_both.register(frontend, zmq.POLLIN)
-    poll_both.register(backend, zmq.POLLIN)
+        self.workers = LRUQueue(args.heartbeatinterval, args.heartbeatliveness, args.policy, args.ewmaalpha)
+        # requests that wait for a worker - bounded by 'maxpending' per priority
+        if args.priority == "strict":
+            self.pending = PendingQueue()
+        else:
+            self.pending = PendingQueue(args.priorityweights)
+        # worker address -> {client envelope: request} of the requests a worker is processing
+        self.inflight = {}
+        # payload-hash -> request of all requests that are waiting or processed
+        self.coalescing = {}
+        self.stats = defaultdict(int)
+
+        self.heartbeat = PeriodicCallback(self.sendHeartbeats, args.heartbeatinterval * 1000)
+        self.setupMetrics()
+
+    def setupMetrics(self):
+        """the metrics are read by the metrics-thread - it only reads sizes and copies"""
+        self.metrics = Registry()
+        self.metrics.gauge("ner_broker_pending_requests", "requests waiting for a free worker",
+                           ["priority"], lambda: dict([((PRIORITIES[idx].decode('utf-8'),), len(lane))
+                                                       for idx, lane in enumerate(self.pending.lanes)]))
+        self.metrics.gauge("ner_broker_inflight_requests", "requests given to a worker that did not reply yet",
+                           function=lambda: sum([len(requests) for requests in list(self.inflight.values())]))
+        self.metrics.gauge("ner_broker_workers", "active workers",
+                           function=lambda: len(self.workers.queue))
+        self.metrics.gauge("ner_broker_worker_credit", "sum of the credit of the active workers",
+                           function=lambda: sum([worker.credit for worker in list(self.workers.queue.values())]))
+        for name, documentation in [("requests", "requests received from clients"),
+                                    ("coalesced", "requests answered by the reply to an identical request"),
+                                    ("rejected", "requests rejected with a busy-reply"),
+                                    ("redispatched", "requests given to an other worker after their worker died"),
+                                    ("expired", "workers that stopped sending heartbeats"),
+                                    ("late", "replies dropped because the request was given to an other worker"),
+                                    ("stale", "requests dropped from the queue because their clients gave up"),
+                                    ("abandoned", "requests no longer coalesced onto because their worker did not answer in time")]:
+            self.metrics.counter("ner_broker_%s_total" % (name), documentation,
+                                 function=lambda name=name: self.stats[name])
+        self.queuelatency = self.metrics.histogram("ner_broker_queue_seconds",
+                                                   "seconds a request waited for a free worker",
+                                                   labelnames=["priority"])
+        self.latency = self.metrics.histogram("ner_broker_request_seconds",
+                                              "seconds from giving a request to a worker until its reply - the count is the amount of replies",
+                                              labelnames=["worker"])
+
+    def start(self):
+        if self.args.metricsport > 0:
+            startMetricsServer(self.metrics, self.args.metricshost, self.args.metricsport)
+        LOGGER.info("Connecting Frontend and Backend.")
+        self.heartbeat.start()
+        IOLoop.current().start()
+
+    def sendHeartbeats(self):
+        """Send heartbeats to the workers and look for expired ones"""
+        LOGGER.debug("Heartbeat-Queue: %s",list(self.workers.queue))
+        for worker in self.workers.queue:
+            LOGGER.debug("sending heartbeat to worker: %s",str(worker))
+            self.backend.send_multipart([worker, PPP_HEARTBEAT])
+
+        for address in self.workers.purge():
+            self.stats['expired'] = self.stats['expired'] + 1
+            self.latency.remove(identity(address))
+            self.redispatch(address)
+
+        for request in self.pending.expire(time.time() - self.args.requesttimeout):
+            self.drop(request)
+
+        for request in list(self.coalescing.values()):
+            if self.overdue(request):
+                self.abandon(request)
+
+        LOGGER.debug("stats: %s", dict(self.stats))
+
+    def handleBackend(self, frames):
+        """Handle worker activity on backend"""
+        address = frames[0]
+
+        # Validate control message, or return reply to client
+        msg = frames[1:]
+        if len(msg) in [1, 2] and msg[0] in [PPP_READY, PPP_HEARTBEAT]:
+            if msg[0] == PPP_READY:
+                # a worker that announces itself again forgot what it was doing
+                self.redispatch(address)
+                worker = self.workers.worker(address, workerInfo(msg))
+                self.workers.ready(worker)
+                LOGGER.info("new Worker connected: %s (credit: %d, maxlength: %d) - %d total",
+                            str(address), worker.credit, worker.maxlength, len(self.workers.queue))
+            else:
+                LOGGER.debug("Heartbeat from Worker: %s - refreshing", str(address))
+                self.workers.refresh(address, workerInfo(msg))
+        elif len(msg) < 3:
+            LOGGER.error("Invalid message from worker: %s", str(msg))
+        else:
+            request = self.inflight.get(address, {}).pop(tuple(msg[:-1]), None)
+            if isinstance(request, type(None)):
+                # the request was given to an other worker in the meantime. the worker may be
+                # registered anew and hold other requests by now - its credit stays as it is
+                LOGGER.info("dropping late reply from worker: %s", str(address))
+                self.stats['late'] = self.stats['late'] + 1
+            else:
+                # if a worker replies it can take another request
+                self.workers.done(address, request)
+                self.latency.observe(time.time() - request.dispatched, identity(address))
+                self.reply(request, msg[-1])
+
+        self.dispatchPending()
+
+    def handleFrontend(self, frames):
+        """forward frontend requests to a worker or keep them until one is free"""
+        frames, priority, length = requestHeaders(frames)
+        request = Request(frames, priority, length=length)
+        self.stats['requests'] = self.stats['requests'] + 1
+
+        # a worker that holds the same payload too long may never answer it
+        if not self.args.nocoalesce and request.key in self.coalescing and self.overdue(self.coalescing[request.key]):
+            self.abandon(self.coalescing[request.key])
+
+        # the same payload is already on its way - wait for that reply
+        if not self.args.nocoalesce and request.key in self.coalescing:
+            leader = self.coalescing[request.key]
+            leader.waiters.append(request.envelope)
+            leader.latest = request.received
+            if isinstance(leader.dispatched, type(None)) and priority < leader.priority:
+                self.pending.promote(leader, priority)
+            self.stats['coalesced'] = self.stats['coalesced'] + 1
+            LOGGER.debug("coalescing request with %d others", len(leader.waiters))
+            return
+
+        if self.workers.available() and len(self.pending) == 0:
+            self.dispatch(request)
+        elif len(self.pending.lanes[priority]) < self.args.maxpending:
+            # every lane has a bound of its own - a full bulk-lane does not reject interactive requests
+            self.pending.append(request)
+            LOGGER.debug("no free worker - %d requests pending", len(self.pending))
+        else:
+            LOGGER.warning("%d %s-requests pending - rejecting request", len(self.pending.lanes[priority]),
+                           PRIORITIES[priority].decode('utf-8'))
+            self.stats['rejected'] = self.stats['rejected'] + 1
+            self.reply(request, BUSY_REPLY)
+            return
+
+        if not self.args.nocoalesce:
+            self.coalescing[request.key] = request
+
+    def dispatch(self, request):
+        address = self.workers.next(request.size, request.length)
+        request.dispatched = time.time()
+        if request.redispatches == 0:
+            self.queuelatency.observe(request.dispatched - request.received, PRIORITIES[request.priority].decode('utf-8'))
+        self.inflight.setdefault(address, {})[request.envelope] = request
+        self.backend.send_multipart([address] + request.frames)
+
+    def dispatchPending(self):
+        while len(self.pending) > 0 and self.workers.available():
+            request = self.pending.popleft()
+            if time.time() - request.latest > self.args.requesttimeout:
+                self.drop(request)
+            else:
+                self.dispatch(request)
+
+    def drop(self, request):
+        """
+        forget a waiting request - its clients gave up. the retries of the clients are
+        queued as requests of their own
+        """
+        LOGGER.debug("dropping request that waited %0.1fs", time.time() - request.received)
+        self.stats['stale'] = self.stats['stale'] + 1
+        if self.coalescing.get(request.key, None) is request:
+            del self.coalescing[request.key]
+
+    def redispatch(self, address):
+        """give the requests of a dead worker to the next free workers - before anything else"""
+        requests = list(self.inflight.pop(address, {}).values())
+        for request in reversed(requests):
+            if request.redispatches < self.args.maxredispatch:
+                request.redispatches = request.redispatches + 1
+                self.stats['redispatched'] = self.stats['redispatched'] + 1
+                self.pending.appendleft(request)
+            else:
+                LOGGER.warning("request failed on %d workers - giving up", request.redispatches + 1)
+                self.reply(request, DEAD_REPLY)
+        if len(requests) > 0:
+            LOGGER.info("redispatching %d requests of worker: %s", len(requests), str(address))
+            self.dispatchPending()
+
+    def overdue(self, request):
+        """a worker holds the request longer then the clients wait"""
+        return (not isinstance(request.dispatched, type(None))
+                and time.time() - request.dispatched > self.args.requesttimeout)
+
+    def abandon(self, request):
+        """
+        stop coalescing onto a request its worker did not answer in time. the clients
+        waiting for it get an error - their retries are requests of their own. the request
+        stays with its worker, a late reply still reaches its own client
+        """
+        LOGGER.warning("worker did not answer a request within %0.1fs - %d waiting clients get an error",
+                       self.args.requesttimeout, len(request.waiters))
+        self.stats['abandoned'] = self.stats['abandoned'] + 1
+        if self.coalescing.get(request.key, None) is request:
+            del self.coalescing[request.key]
+        for envelope in request.waiters:
+            self.frontend.send_multipart(list(envelope) + [ABANDONED_REPLY])
+        request.waiters = []
+
+    def reply(self, request, payload):
+        """reply to the client and every client that waits for the same payload"""
+        if self.coalescing.get(request.key, None) is request:
+            del self.coalescing[request.key]
+        # everything but the last frame of a request is the envelope of the client
+        for envelope in [request.envelope] + request.waiters:
+            self.frontend.send_multipart(list(envelope) + [payload])
 
-    workers = LRUQueue()
 
-    heartbeat_at = time.time() + args.heartbeatinterval
+def main(args):
+    """ main method """
 
-    while True:
-        if len(workers.queue) > 0:
-            poller = poll_both
-        else:
-            poller = poll_workers
-        socks = dict(poller.poll(args.heartbeatinterval * 1000))
-
-        # Send heartbeats to idle workers if it's time
-        if time.time() >= heartbeat_at:
-            LOGGER.debug("Heartbeat-Queue: %s",list(workers.queue))
-            for worker in workers.queue:
-                LOGGER.debug("sending heartbeat to worker: %s",str(worker))
-                msg = [worker, PPP_HEARTBEAT]
-                backend.send_multipart(msg)
-
-            heartbeat_at = time.time() + args.heartbeatinterval
-
-        # Handle worker activity on backend
-        if socks.get(backend) == zmq.POLLIN:
-            # Use worker address for LRU routing
-            frames = backend.recv_multipart()
-            if not frames:
-                break
-
-            address = frames[0]
-
-            # Validate control message, or return reply to client
-            msg = frames[1:]
-            if len(msg) == 1:
-                if msg[0] == PPP_READY:
-                    workers.ready(Worker(address))
-                    LOGGER.info("new Worker connected: %s - %d total", str(address),len(workers.queue))
-                elif msg[0] == PPP_HEARTBEAT:
-                    LOGGER.debug("Heartbeat from Worker: %s - refreshing", str(address))
-                    workers.ready(Worker(address))
-                else:
-                    LOGGER.error("Invalid message from worker: %s", str(msg))
-            else:
-                # if a worker replies put it back into the queue
-                workers.ready(Worker(address))
-                frontend.send_multipart(msg)
-                
-                
-        # forward frontend requests to worker
-        if socks.get(frontend) == zmq.POLLIN:
-            frames = frontend.recv_multipart()
-            if not frames:
-                break
-            
-            frames.insert(0, workers.next())
-            backend.send_multipart(frames)
-
-
-        # cycle complete - check for exipred workers
-        workers.purge()
+    broker = Broker(args)
+    broker.start()
                 
     
 
@@ -169,6 +550,17 @@ if __name__ == "__main__":
         formatter_class = RawTextDefaultsHelpFormatter,
         description="""
 zmq-broker/proxy. accepts zmq-requests on the fronted side and forwards them to the zmq-response-servers that connected on the backendside. Does a LRU-Loadbalancing if more then one backend is connected. 
+a worker may announce a credit with its READY and HEARTBEAT ('{"credit": 4}' as second frame). It then gets up to
+that amount of requests at once - the least loaded worker is preferred.
+with '"maxlength": <characters>' in that frame a worker only gets requests with longer texts if no other worker is free.
+clients may send the length of the longest text as a frame 'length:<n>' in front of the payload, otherwise the size
+of the payload is used.
+requests with the same payload as a request that is already waiting or processed get its reply too.
+if a worker dies (no heartbeats) while processing requests, they are given to an other worker.
+if no worker is free requests are kept in a queue. clients may send a frame 'interactive' or 'bulk'
+in front of the payload - interactive requests are taken from the queue first ('--priority'). if the queue of its priority is full the client gets
+'{"result": null, "error": "busy", "busy": true}' immediately. requests that waited longer then '--requesttimeout'
+are dropped - their clients already sent a retry.
         """,
         epilog = """
         """)
@@ -184,6 +576,37 @@ zmq-broker/proxy. accepts zmq-requests on the fronted side and forwards them to
     parser.add_argument('--backendsocket', type = str,
                         default = "tcp://127.0.0.1:5560",
                         help = "bind to this socket and wait for servers to connect. Use tcp://*:5560 to bind to every ip")
+    parser.add_argument('--maxpending', type = int,
+                        default = 1000,
+                        help = "the amount of requests per priority that may wait for a free worker. if more requests of that priority arrive they are rejected with a busy-reply")
+    parser.add_argument('--requesttimeout', type = float,
+                        default = 10.0,
+                        help = "seconds after which the clients give up on a request - queued requests older then that are dropped instead of given to a worker and requests a worker holds longer then that are no longer coalesced onto. use the longest timeout of the clients")
+    parser.add_argument('--priority', type = str,
+                        choices=['strict','weighted'],
+                        default = 'strict',
+                        help = "how to take requests from the queue. strict: bulk-requests only if no interactive request is waiting. weighted: per round 'priorityweights' requests of every priority")
+    parser.add_argument('--priorityweights', type = int, nargs=2,
+                        default = [8,1],
+                        help = "interactive and bulk requests per round for the weighted priority")
+    parser.add_argument('--policy', type = str,
+                        choices=['lru','ewma','ewma-size'],
+                        default = 'lru',
+                        help = "how to choose the worker for a request. lru: the least loaded worker. ewma: the worker that is expected to finish first by its (exponentially weighted) average time per request. ewma-size: the same but per byte of the requests - long texts count more")
+    parser.add_argument('--ewmaalpha', type = float,
+                        default = 0.3,
+                        help = "the weight of the newest measurement in the averages of the ewma-policies")
+    parser.add_argument('--nocoalesce', action='store_true',
+                        help = "send every request to a worker, even if a request with the same payload is already waiting or processed")
+    parser.add_argument('--maxredispatch', type = int,
+                        default = 1,
+                        help = "how often a request is given to an other worker if the worker that processes it dies. a request that kills every worker is only tried this often")
+    parser.add_argument('--metricsport', type = int,
+                        default = 0,
+                        help = "serve prometheus-metrics via http on this port (path /metrics). 0 disables the metrics")
+    parser.add_argument('--metricshost', type = str,
+                        default = "127.0.0.1",
+                        help = "the address the metrics are served on. Use 0.0.0.0 for every ip")
     parser.add_argument('--heartbeatinterval', type = float,
                         default=2.0,
                         help = "interval of heartbeats for worker and clients in seconds")